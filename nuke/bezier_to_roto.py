@@ -1,29 +1,106 @@
 """
 Select Bezier Nodes and copy them into 1 Roto Node
+* shapes can also be exported into a compact npz interchange file and imported as Roto Node
 """
 
-import math
 import re
+from array import array
 
+import numpy as np
 import nuke
 from nuke.rotopaint import Shape, ShapeControlPoint, CVec2
 
+TOKENS = re.compile(r"[{}\n]|[^\s{}]+")
+CHUNKS = re.compile(r"[{}\n]|[^{}\n]+")
+DIGIT = re.compile(r"\d")
+SLOPE = re.compile(r"[stuv]")  # slope and tangent tokens of a curve, not values
+POINT_SIZE = 12  # x, y, tangent and feather lengths/angles of a bezier point
+CONTROLPOINTS = [
+    "center",
+    "rightTangent",
+    "leftTangent",
+    "featherCenter",
+    "featherRightTangent",
+    "featherLeftTangent",
+]
+
+
+def tokenize(script):
+    "yield braces, line breaks and words of a knob script in a single pass"
+    for match in TOKENS.finditer(script):
+        yield match.group()
+
+
+def points_block(block):
+    "a block holding a single line of values is one point, not a keyframe"
+    return isinstance(block, array) or (len(block) == 1 and isinstance(block[0], array))
+
+
+def flatten_points(block):
+    "all points of a block and its nested blocks, in order"
+    if isinstance(block, array):
+        return [block]
+
+    return [point for item in block for point in flatten_points(item)]
+
+
+def parse_points(script):
+    """split points knob script into keyframes
+    -   script: toScript() of the points knob, one {block} per keyframe, one line per point
+    - returns list of keyframes, each a list of points as float arrays
+    """
+    root = []
+    stack = [root]
+    line_breaks = set()  # ids of blocks with a line break between their items
+    point = array("d")
+
+    # braces and line breaks are single tokens, numbers in between come as one chunk
+    for match in CHUNKS.finditer(script):
+        token = match.group()
+        if token == "{" or token == "}" or token == "\n":
+            if point:
+                stack[-1].append(point)
+                point = array("d")
+            if token == "{":
+                stack[-1].append([])
+                stack.append(stack[-1][-1])
+            elif token == "}":
+                if len(stack) > 1:
+                    stack.pop()
+            else:
+                line_breaks.add(id(stack[-1]))
+        else:
+            point.extend(map(float, token.split()))
+
+    if point:
+        stack[-1].append(point)
+
+    # keyframes are the top level sibling blocks, whatever number of braces wraps them
+    while len(root) == 1 and isinstance(root[0], list):
+        root = root[0]
+
+    if all(points_block(item) for item in root):
+        if len(root) > 1 and id(root) not in line_breaks:
+            # "{x y ..} {x y ..}", keyframes of one point each
+            return [flatten_points(item) for item in root]
+        return [flatten_points(root)] if root else []
+
+    keyframes = []
+    for item in root:
+        if points_block(item):
+            # loose points between keyframe blocks belong together
+            if not keyframes or not keyframes[-1][1]:
+                keyframes.append(([], True))
+            keyframes[-1][0].extend(flatten_points(item))
+        else:
+            keyframes.append((flatten_points(item), False))
+
+    return [points for points, _ in keyframes if points]
+
 
 def get_bezier_points(node):
     "get bezier node points for each keyframe"
-    bezier_points = node["points"].toScript().strip("{}")
-    points = []
-    for keyframe in bezier_points.split("} {"):
-        p_key = 0
-        p_dict = {}
-        for k in keyframe.split("\n"):
-            if not k:
-                continue
-            p_dict[p_key] = k.strip("{}")
-            p_key += 1
-        points.append(p_dict)
-
-    return points
+    return parse_points(node["points"].toScript())
 
 
 def get_keyframes(shape):
@@ -32,20 +109,26 @@ def get_keyframes(shape):
         # no animation, return only 1 keyframe
         return [nuke.root().firstFrame()]
 
-    key_list = shape[1:-1].split(" ")
     keyframes = []
-    for enum, k in enumerate(key_list):
-        if not re.search(r"\d", k):
-            continue
+    frame = None
+    step = 1
 
-        elif k.startswith("x"):
-            keyframes.append(int(k[1:]))
+    for token in tokenize(shape):
+        if not DIGIT.search(token) or SLOPE.match(token):
+            continue  # braces, curve and interpolation flags, slopes and tangents
 
-        elif not keyframes and k == "0":
-            keyframes.append(0)
+        if token.startswith("x"):
+            frame = float(token[1:])
+            continue
 
-        elif not key_list[enum - 1].startswith("x"):
-            keyframes.append(keyframes[-1] * 2 - keyframes[-2])
+        if frame is None:
+            # implicit frame continues with the last step between keys
+            frame = keyframes[-1] + step if keyframes else 0
+
+        keyframes.append(frame)
+        if len(keyframes) > 1:
+            step = keyframes[-1] - keyframes[-2]
+        frame = None
 
     return keyframes
 
@@ -66,82 +149,242 @@ def set_interpolation_type(acp):
         index += 1
 
 
-def collect_anim_keys(root):
-    "clean collection of ShapeControlPoints to call set_interpolation_type"
-    for shape in root:
-        for point in shape:
-            set_interpolation_type(point.center)
-            set_interpolation_type(point.featherCenter)
-            set_interpolation_type(point.rightTangent)
-            set_interpolation_type(point.featherRightTangent)
-            set_interpolation_type(point.leftTangent)
-            set_interpolation_type(point.featherLeftTangent)
-
+def pad_points(points):
+    """stack parsed points of all keyframes into one array
+    -   points: keyframes from get_bezier_points
+    - returns values (keyframes, points, 12), zero padded, and number of values per point
+    """
+    values = np.zeros((len(points), len(points[0]), POINT_SIZE))
+    lengths = np.zeros((len(points), len(points[0])), dtype=int)
+    for k, keyframe in enumerate(points):
+        for i, point in enumerate(keyframe):
+            values[k, i, : len(point)] = point
+            lengths[k, i] = len(point)
+
+    return values, lengths
+
+
+def polar(length, angle):
+    "cartesian x, y from polar coordinates, stacked on the last axis"
+    return np.stack((length * np.cos(angle), length * np.sin(angle)), axis=-1)
+
+
+def compute_controlpoints(values, lengths):
+    """convert bezier values of all points and keyframes at once
+    -   values, lengths: from pad_points, missing offsets stay 0.0
+    - returns {ShapeControlPoint attribute: (x/y array (keyframes, points, 2), key mask)}
+    """
+    p = np.moveaxis(values, -1, 0)
+    has = lengths[..., np.newaxis]
+
+    right = polar(p[2], p[3])
+    left = -polar(p[4], p[3] + p[5])
+
+    angle = p[3] + p[7]
+    feather_center = np.stack((-p[6] * np.sin(angle), p[6] * np.cos(angle)), axis=-1)
+
+    angle = p[3] + p[9]
+    feather_right = np.where(has >= 10, polar(p[8] + p[2], angle), right)
+    feather_left = np.where(
+        has >= 11,
+        -polar(p[10] + p[4], angle + p[11]),
+        np.where(has >= 10, -feather_right, left),
+    )
+
+    tangents = lengths >= 5
+    return {
+        "center": (p[:2].transpose(1, 2, 0), np.ones(lengths.shape, dtype=bool)),
+        "rightTangent": (right, tangents),
+        "leftTangent": (left, tangents),
+        "featherCenter": (feather_center, tangents),
+        "featherRightTangent": (feather_right, tangents),
+        "featherLeftTangent": (feather_left, tangents),
+    }
+
+
+def reduce_keyframes(keyframes, controlpoints, tolerance):
+    """drop keys that linear interpolation between the remaining keys reproduces
+    -   keyframes: frames of the shape
+        controlpoints: from compute_controlpoints
+        tolerance: max distance in pixels any value of any point may move
+    - returns reduced keyframes and controlpoints
+    """
+    if tolerance <= 0 or len(keyframes) < 3:
+        return keyframes, controlpoints
+
+    frames = np.asarray(keyframes, dtype=float)
+    masks = np.concatenate([mask for _, mask in controlpoints.values()], axis=1)
+    curves = np.concatenate(
+        [np.where(mask[..., np.newaxis], xy, 0.0) for xy, mask in controlpoints.values()], axis=1
+    )
+
+    # keys where points gain or lose tangents have to stay
+    keep = np.zeros(len(frames), dtype=bool)
+    keep[[0, -1]] = True
+    changed = np.any(masks[1:] != masks[:-1], axis=1)
+    keep[1:] |= changed
+    keep[:-1] |= changed
+
+    # Ramer-Douglas-Peucker over time, all points and values of a segment at once
+    anchors = np.flatnonzero(keep)
+    segments = list(zip(anchors[:-1], anchors[1:]))
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
 
-def set_controlpoints(index, keyframes, points):
-    "create roto ShapeControlPoint and set attributes of bezier points"
-    scp = ShapeControlPoint()
-    for enum, point in enumerate(points):
-        frame = keyframes[enum]
-        p = [float(f) for f in point[index].split(" ")]
-        pl = len(p)
-        scp.center.addPositionKey(frame, CVec2(p[0], p[1]))
+        t = (frames[first + 1 : last] - frames[first]) / (frames[last] - frames[first])
+        line = curves[first] + t[:, np.newaxis, np.newaxis] * (curves[last] - curves[first])
+        error = np.linalg.norm(curves[first + 1 : last] - line, axis=-1).max(axis=1)
 
-        if pl < 5:
-            continue
+        worst = int(error.argmax())
+        if error[worst] > tolerance:
+            split = first + 1 + worst
+            keep[split] = True
+            segments.extend([(first, split), (split, last)])
 
-        angle = p[3]
-        tangent_rx = p[2] * math.cos(angle)
-        tangent_ry = p[2] * math.sin(angle)
+    index = np.flatnonzero(keep)
+    return [keyframes[i] for i in index], {
+        attribute: (xy[index], mask[index]) for attribute, (xy, mask) in controlpoints.items()
+    }
 
-        if pl >= 6:
-            offset = p[5]
-        else:
-            offset = 0.0
 
-        tangent_lx = -(p[4] * math.cos(angle + offset))
-        tangent_ly = -(p[4] * math.sin(angle + offset))
+def set_controlpoints(index, keyframes, controlpoints):
+    "create roto ShapeControlPoint and set keys from precomputed controlpoints"
+    scp = ShapeControlPoint()
+    for attribute, (xy, mask) in controlpoints.items():
+        acp = getattr(scp, attribute)
+        for frame, (x, y), valid in zip(keyframes, xy[:, index].tolist(), mask[:, index]):
+            if valid:
+                acp.addPositionKey(frame, CVec2(x, y))
+        # still detached from any knob, so this doesn't trigger a redraw
+        set_interpolation_type(acp)
 
-        scp.rightTangent.addPositionKey(frame, CVec2(tangent_rx, tangent_ry))
-        scp.featherRightTangent.addPositionKey(frame, CVec2(tangent_rx, tangent_ry))
-        scp.leftTangent.addPositionKey(frame, CVec2(tangent_lx, tangent_ly))
-        scp.featherLeftTangent.addPositionKey(frame, CVec2(tangent_lx, tangent_ly))
+    return scp
 
-        if pl < 7:
-            scp.featherCenter.addPositionKey(frame, CVec2(0, 0))
-            continue
 
-        if pl >= 8:
-            angle = p[3] + p[7]
+def read_shape(bezier):
+    """parse a bezier node into plain arrays
+    - returns {name, keyframes, values, lengths, controlpoints}
+    """
+    values, lengths = pad_points(get_bezier_points(bezier))
+    return {
+        "name": bezier.name(),
+        "keyframes": np.asarray(get_keyframes(bezier["shape"].toScript()), dtype=float),
+        "values": values,
+        "lengths": lengths,
+        "controlpoints": compute_controlpoints(values, lengths),
+    }
+
+
+def save_shapes(path, shapes):
+    "write parsed shapes into one compressed npz interchange file"
+    arrays = {"names": np.array([shape["name"] for shape in shapes])}
+    for i, shape in enumerate(shapes):
+        for key in ["keyframes", "values", "lengths"]:
+            arrays[f"{i}/{key}"] = shape[key]
+        for attribute, (xy, mask) in shape["controlpoints"].items():
+            arrays[f"{i}/{attribute}"] = xy
+            arrays[f"{i}/{attribute}_mask"] = mask
+
+    np.savez_compressed(path, **arrays)
+
+
+class ShapeCache:
+    """shapes of an interchange file written by save_shapes
+    only the names are read on open, arrays of a shape are read when it is accessed
+    """
+
+    def __init__(self, path):
+        self.archive = np.load(path)
+        self.names = self.archive["names"].tolist()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        for index in range(len(self.names)):
+            yield self[index]
+
+    def __getitem__(self, key):
+        "shape by index or name"
+        index = self.names.index(key) if isinstance(key, str) else key
+        return {
+            "name": self.names[index],
+            "keyframes": self.archive[f"{index}/keyframes"],
+            "values": self.archive[f"{index}/values"],
+            "lengths": self.archive[f"{index}/lengths"],
+            "controlpoints": {
+                attribute: (
+                    self.archive[f"{index}/{attribute}"],
+                    self.archive[f"{index}/{attribute}_mask"],
+                )
+                for attribute in CONTROLPOINTS
+            },
+        }
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_shape(curves, shape, tolerance=0):
+    """build complete roto shape from read_shape data, without adding it to the curves knob yet
+    with a tolerance in pixels, keys that linear interpolation reproduces are left out
+    """
+    keyframes, controlpoints = reduce_keyframes(
+        shape["keyframes"].tolist(), shape["controlpoints"], tolerance
+    )
+
+    roto_shape = Shape(curves)
+    roto_shape.name = shape["name"]
+    for index in range(shape["values"].shape[1]):
+        roto_shape.append(set_controlpoints(index, keyframes, controlpoints))
+
+    return roto_shape
+
+
+def create_roto(shapes, tolerance=0):
+    """create 1 roto node holding all given shapes from read_shape or a ShapeCache
+    shapes are built first and added at once, so the curves knob updates a single time
+    """
+    roto = nuke.nodes.Roto()
+    curves = roto["curves"]
 
-        center_offx = p[6] * math.sin(angle)
-        center_offy = p[6] * math.cos(angle)
-        scp.featherCenter.addPositionKey(frame, CVec2(-center_offx, center_offy))
+    roto_shapes = [build_shape(curves, shape, tolerance) for shape in shapes]
+    for roto_shape in roto_shapes:
+        curves.rootLayer.append(roto_shape)
+    curves.changed()
 
-        if pl < 10:
-            continue
+    return roto
 
-        angle = p[3] + p[9]
-        right_offx = (p[8] + p[2]) * math.cos(angle)
-        right_offy = (p[8] + p[2]) * math.sin(angle)
 
-        scp.featherRightTangent.addPositionKey(frame, CVec2(right_offx, right_offy))
+def export_shapes():
+    "save shapes of selected bezier nodes into an interchange file"
+    selected_nodes = nuke.selectedNodes("Bezier")
 
-        if pl < 11:
-            scp.featherLeftTangent.addPositionKey(frame, CVec2(-right_offx, -right_offy))
-            continue
+    if not selected_nodes:
+        nuke.message("Please select the bezier node(s) you want to export.")
+        return
 
-        if pl >= 12:
-            offset = p[11]
-        else:
-            offset = 0.0
+    path = nuke.getFilename("Export Shapes", "*.npz")
+    if path:
+        save_shapes(path, [read_shape(b) for b in selected_nodes])
 
-        left_offx = -(p[10] + p[4]) * math.cos(angle + offset)
-        left_offy = -(p[10] + p[4]) * math.sin(angle + offset)
 
-        scp.featherLeftTangent.addPositionKey(frame, CVec2(left_offx, left_offy))
+def import_shapes():
+    "create roto node from an interchange file"
+    path = nuke.getFilename("Import Shapes", "*.npz")
+    if not path:
+        return
 
-    return scp
+    with ShapeCache(path) as cache:
+        create_roto(cache)
 
 
 def copy_bezier_to_roto():
@@ -165,23 +408,19 @@ def copy_bezier_to_roto():
         if not nuke.ask(question):
             return
 
-    roto = nuke.nodes.Roto()
-
-    for b in selected_nodes:
-        shape = b["shape"].toScript()
-        points = get_bezier_points(b)
-        keyframes = get_keyframes(shape)
-
-        roto_shape = Shape(roto["curves"])
-        roto_shape.name = b.name()
+    tolerance = 0
+    if any(n["shape"].toScript() for n in selected_nodes):
+        tolerance = nuke.getInput("Keyframe reduction tolerance in pixels (0 keeps all keys)", "0")
+        if tolerance is None:
+            return
 
-        all_points = len(points[0])
-        for index in range(all_points):
-            roto_shape.append(set_controlpoints(index, keyframes, points))
-            roto["curves"].changed()
+    try:
+        tolerance = float(tolerance)
+    except ValueError:
+        nuke.message(f"{tolerance} is not a valid tolerance, please enter a number of pixels.")
+        return
 
-    roto["curves"].rootLayer.append(roto_shape)
-    collect_anim_keys(roto["curves"].rootLayer)
+    create_roto([read_shape(b) for b in selected_nodes], tolerance)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,238 @@
+"""
+Batch convert Bezier Nodes of many scripts into Roto Nodes
+* every .nk file found in a directory is converted by its own `nuke -t` worker
+* each Bezier Node is replaced by a Roto Node with the same name, position and connections
+* converted scripts are saved as the next version not on disk yet, existing files are never
+  overwritten, a json report summarises the whole run
+* scripts listed as output in the report of an earlier run are not converted again
+
+usage: python bezier_to_roto_batch.py <directory> [--output dir] [--workers 4] [--nuke nuke]
+                                      [--tolerance 0.5]
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+NUKE = os.environ.get("NUKE_EXE", "nuke")
+RESULT = "BEZIER_TO_ROTO_RESULT "  # marks the worker's summary line on stdout
+VERSION = re.compile(r"_v(\d+)")
+
+
+def next_version(path, taken=()):
+    """path of the next script version that is neither on disk nor taken, unversioned scripts
+    start at _v001
+    -   path: script to version up
+        taken: absolute paths not to use, given to other scripts or written before
+    """
+    head, tail = os.path.split(path)
+    name, ext = os.path.splitext(tail)
+    versions = list(VERSION.finditer(name))
+
+    if versions:
+        digits = len(versions[-1].group(1))
+        number = int(versions[-1].group(1)) + 1
+        start, end = versions[-1].span(1)
+        prefix, suffix = name[:start], name[end:]
+    else:
+        digits, number = 3, 1
+        prefix, suffix = f"{name}_v", ""
+
+    while True:
+        candidate = os.path.join(head, f"{prefix}{number:0{digits}}{suffix}{ext}")
+        if os.path.abspath(candidate) not in taken and not os.path.exists(candidate):
+            return candidate
+        number += 1
+
+
+def find_scripts(directory):
+    "all nk scripts in directory and its subfolders"
+    scripts = []
+    for root, _, files in os.walk(directory):
+        scripts.extend(os.path.join(root, f) for f in sorted(files) if f.endswith(".nk"))
+
+    return scripts
+
+
+def output_path(script, directory, output, taken=()):
+    "new script version, in the output directory with the same subfolders if given"
+    if output:
+        script = os.path.join(output, os.path.relpath(script, directory))
+
+    return next_version(script, taken)
+
+
+def generated_scripts(report):
+    "absolute paths of scripts written by earlier runs, read from the last json report"
+    if not os.path.isfile(report):
+        return set()
+
+    with open(report) as f:
+        summary = json.load(f)
+
+    outputs = [r["output"] for r in summary.get("results", []) if r.get("output")]
+    return {os.path.abspath(p) for p in summary.get("generated", []) + outputs}
+
+
+def convert_script(script, target, tolerance=0):
+    """worker side, runs inside nuke -t
+    -   script: nk file to open
+        target: file to save the converted script to
+        tolerance: keyframe reduction in pixels, 0 keeps all keys
+    - returns summary of the conversion
+    """
+    import nuke
+    from bezier_to_roto import create_roto, read_shape
+
+    if os.path.exists(target):
+        # another version appeared since the target was picked, never save over it
+        return {"script": script, "error": f"{target} already exists"}
+
+    nuke.scriptOpen(script)
+    converted = []
+    non_linear = []
+
+    for bezier in nuke.allNodes("Bezier", recurseGroups=True):
+        full_name = bezier.fullName()
+        parent = nuke.toNode(full_name.rpartition(".")[0]) if "." in full_name else nuke.root()
+
+        if not bezier["linear"].value() and bezier["shape"].toScript():
+            non_linear.append(full_name)
+
+        with parent:
+            roto = create_roto([read_shape(bezier)], tolerance)
+            roto.setXYpos(bezier.xpos(), bezier.ypos())
+            roto.setInput(0, bezier.input(0))
+
+            for dependent in bezier.dependent(nuke.INPUTS | nuke.HIDDEN_INPUTS, False):
+                for i in range(dependent.inputs()):
+                    if dependent.input(i) == bezier:
+                        dependent.setInput(i, roto)
+
+            name = bezier.name()
+            nuke.delete(bezier)
+            roto.setName(name)
+
+        converted.append(full_name)
+
+    if converted:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        nuke.scriptSaveAs(target, overwrite=0)
+
+    return {
+        "script": script,
+        "output": target if converted else None,
+        "converted": converted,
+        "non_linear": non_linear,
+    }
+
+
+def run_worker(script, target, nuke_exe, tolerance=0):
+    "start one nuke -t worker for a script and read back its summary"
+    cmd = [nuke_exe, "-t", os.path.abspath(__file__), "--worker", script, target]
+    cmd += ["--tolerance", str(tolerance)]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+    except OSError as err:
+        return {"script": script, "error": str(err)}
+
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT):
+            return json.loads(line[len(RESULT) :])
+
+    return {
+        "script": script,
+        "error": proc.stderr.strip()[-2000:] or f"exit code {proc.returncode}",
+    }
+
+
+def convert_directory(directory, output=None, workers=4, nuke_exe=NUKE, report=None, tolerance=0):
+    """convert all scripts of a directory in parallel nuke -t workers
+    - returns list of summaries, also written as json report
+    """
+    report = report or os.path.join(output or directory, "bezier_to_roto_report.json")
+    generated = generated_scripts(report)
+    taken = set(generated)
+    found = find_scripts(directory)
+    scripts = [s for s in found if os.path.abspath(s) not in generated]
+    skipped = len(found) - len(scripts)
+
+    # targets are picked up front, so two scripts of a run never get the same version
+    targets = {}
+    for s in scripts:
+        targets[s] = output_path(s, directory, output, taken)
+        taken.add(os.path.abspath(targets[s]))
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_worker, s, targets[s], nuke_exe, tolerance): s for s in scripts}
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if "error" in result:
+                state = "failed"
+            else:
+                state = f"{len(result['converted'])} Bezier(s)"
+            print(f"{state:>16}  {futures[future]}")
+
+    results.sort(key=lambda r: r["script"])
+    summary = {
+        "directory": directory,
+        "scripts": len(scripts),
+        "skipped_generated": skipped,
+        "converted_scripts": len([r for r in results if r.get("output")]),
+        "converted_beziers": sum(len(r.get("converted", [])) for r in results),
+        "failed": [r["script"] for r in results if "error" in r],
+        # carried over, so later runs still skip what earlier runs wrote
+        "generated": sorted(
+            generated | {os.path.abspath(r["output"]) for r in results if r.get("output")}
+        ),
+        "results": results,
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(report)), exist_ok=True)
+    with open(report, "w") as f:
+        json.dump(summary, f, indent=4)
+
+    print(
+        f"{summary['converted_beziers']} Bezier(s) in {summary['converted_scripts']} of "
+        + f"{summary['scripts']} scripts converted, {len(summary['failed'])} failed, "
+        + f"{skipped} generated by earlier runs skipped. "
+        + f"Report: {report}"
+    )
+    return results
+
+
+def main(argv=None):
+    "command line entry point"
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("directory", nargs="?", help="folder with nk scripts")
+    parser.add_argument("--output", help="write new versions here instead of next to the scripts")
+    parser.add_argument("--workers", type=int, default=4, help="parallel nuke -t processes")
+    parser.add_argument("--nuke", default=NUKE, help="nuke executable, default $NUKE_EXE")
+    parser.add_argument("--report", help="json report, default in output or script folder")
+    parser.add_argument(
+        "--tolerance", type=float, default=0, help="keyframe reduction in pixels, 0 keeps all keys"
+    )
+    parser.add_argument("--worker", nargs=2, metavar=("SCRIPT", "TARGET"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        print(RESULT + json.dumps(convert_script(*args.worker, args.tolerance)))
+        return
+
+    if not args.directory:
+        parser.error("directory is required")
+
+    convert_directory(
+        args.directory, args.output, args.workers, args.nuke, args.report, args.tolerance
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,130 +1,417 @@
-"read camera tracker's feature tracks and export as txt file "
+"thin out and export camera tracker's feature tracks for PFTrack, 3DEqualizer, SynthEyes or NumPy"
 
 import os
+import hashlib
+import json
 import ntpath
+import tempfile
 from datetime import datetime
 
-import nuke
+import numpy as np
 
+try:
+    import nuke
+except ImportError:
+    # parsing and writers stay usable without Nuke, see cameratracker_batch.py
+    nuke = None
 
-def append_frames(serialized_data, index, tmp, startframe, lifetime_idx=0):
-    """append data sets to converted track list
-    -   serialized_data: serialise knob as list of lists
-        index: current single list's index
-        tmp: current single list
-        startframe: first frame of tracker
+# one row per tracked frame of a feature track
+TRACK_DTYPE = np.dtype(
+    [("frame", np.int32), ("x", np.float64), ("y", np.float64), ("error", np.float64)]
+)
+
+
+def read_track(lines, index, rows, lifetime_idx=0):
+    """collect the lines holding one track's positions, one per frame
+    -   lines: lines of serialize knob
+        index: line of track's first position
+        rows: position lines of all tracks, as "_ error x y ...", extended in place
         lifetime_idx: position offset of tracker's lifetime
-    - returns track's position points and accuracy of pattern
+    - returns number of positions
     """
-    first_header = serialized_data[index + 1]
-    position_list = []
-    frame = 1
+    count = len(rows)
+    first = lines[index].split(" ")
+    rows.append(f"{first[0]} {first[1]} {first[2 + lifetime_idx]} {first[3 + lifetime_idx]}")
+    first_header = lines[index + 1].split(" ")
 
     if len(first_header) < 5:
-        second_header = serialized_data[index + 2]
-        lifetime = second_header[6 + lifetime_idx]
-        position_list.append([startframe, tmp[2 + lifetime_idx], tmp[3 + lifetime_idx], tmp[1]])
-
+        second_header = lines[index + 2].split(" ")
+        lifetime = int(second_header[6 + lifetime_idx])
         if len(second_header) == 13 + lifetime_idx:
-            position_list.append(
-                [startframe + frame, second_header[2], second_header[3], second_header[1]]
-            )
-            frame += 1
-
-        for x in range(2, int(lifetime)):
-            items = serialized_data[index + 1 + x]
-            position_list.append([startframe + frame, items[2], items[3], items[1]])
-            frame += 1
-            if len(items) > 7 and items[7] == second_header[0]:
-                position_list.append(
-                    [
-                        startframe + frame,
-                        second_header[2],
-                        second_header[3],
-                        second_header[1],
-                    ]
-                )
-                frame += 1
+            rows.append(lines[index + 2])
+
+        # the second header's position repeats after lines pointing back to it
+        key = second_header[0]
+        for line in lines[index + 3 : index + lifetime + 1]:
+            rows.append(line)
+            if key in line:
+                items = line.split(" ", 8)
+                if len(items) > 7 and items[7] == key:
+                    rows.append(lines[index + 2])
 
     else:
-        lifetime = first_header[4 + lifetime_idx]
-        position_list.append([startframe, tmp[2 + lifetime_idx], tmp[3 + lifetime_idx], tmp[1]])
+        lifetime = int(first_header[4 + lifetime_idx])
+        rows.extend(lines[index + 2 : index + lifetime + 1])
 
-        for x in range(1, int(lifetime)):
-            items = serialized_data[index + 1 + x]
-            position_list.append([startframe + x, items[2], items[3], items[1]])
+    return len(rows) - count
 
-    return position_list
+
+def parse_tracks(script):
+    """single pass over a serialize knob script, values are converted in one go
+    - returns track ids and one structured array (frame, x, y, error) per track
+    """
+    lines = script.split("\n")[1:]
+    rows = []
+    startframes = []
+    lengths = []
+
+    header = lines[1].split(" ")
+    if int(header[2]):
+        startframe = int(header[3])
+        first = 2
+    else:
+        startframe = int(lines[0].split(" ")[3])
+        first = 1
+    identification = lines[first].split(" ")[-3]
+    startframes.append(startframe)
+    lengths.append(read_track(lines, first, rows, 2))
+
+    suffix = f" {identification}"
+    for index, line in enumerate(lines):
+        if line.endswith(suffix) or line == identification:
+            footnote = lines[index - 1].split(" ", 4)
+            if footnote[1] == "0" and footnote[2] == "1":
+                startframe = int(footnote[3])
+            startframes.append(startframe)
+            lengths.append(read_track(lines, index, rows))
+
+    points = np.zeros(len(rows), dtype=TRACK_DTYPE)
+    if rows:
+        values = np.loadtxt(rows, usecols=(1, 2, 3), comments=None, ndmin=2)
+        points["error"], points["x"], points["y"] = values.T
+
+    # frames count up from each track's start frame
+    lengths = np.array(lengths)
+    offsets = np.repeat(np.array(startframes) - (np.cumsum(lengths) - lengths), lengths)
+    points["frame"] = np.arange(len(rows)) + offsets
+
+    tracks = np.split(points, np.cumsum(lengths)[:-1])
+    return np.arange(1, len(tracks) + 1), tracks
 
 
 def export_cameratrack(node):
-    """export serialize knob as list items
+    """parse serialize knob of a CameraTracker
     - node: which node triggered the action
-    returns nested positions and pattern accuracy across frames in track list
+    returns track ids and positions with pattern accuracy per track
     """
-    s = node["serializeKnob"].toScript()
+    return parse_tracks(node["serializeKnob"].toScript())
 
-    output = []
 
-    serialized_data = [line.split(" ") for line in s.split("\n")]
-    serialized_data.pop(0)
+def density_mask(points, lifetime, cell_size, per_cell):
+    """at most per_cell positions per grid cell and frame, longest tracks and lowest error first
+    -   points: positions of all tracks, TRACK_DTYPE
+        lifetime: lifetime of each position's track
+        cell_size: grid cell size in pixels
+        per_cell: positions kept per cell and frame
+    - returns bool mask of kept positions
+    """
+    cell_x = np.floor(points["x"] / cell_size).astype(np.int64)
+    cell_y = np.floor(points["y"] / cell_size).astype(np.int64)
+    order = np.lexsort((points["error"], -lifetime, cell_y, cell_x, points["frame"]))
+    frame, cell_x, cell_y = points["frame"][order], cell_x[order], cell_y[order]
 
-    if int(serialized_data[1][2]):
-        startframe = serialized_data[1][3]
-        identification = serialized_data[2][-3]
-        output.append(append_frames(serialized_data, 2, serialized_data[2], int(startframe), 2))
-    else:
-        startframe = serialized_data[0][3]
-        identification = serialized_data[1][-3]
-        output.append(append_frames(serialized_data, 1, serialized_data[1], int(startframe), 2))
+    # rank inside each frame and cell, counted from the cell's first sorted position
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (np.diff(frame) != 0) | (np.diff(cell_x) != 0) | (np.diff(cell_y) != 0)
+    positions = np.arange(len(order))
+    rank = positions - np.maximum.accumulate(np.where(first, positions, 0))
 
-    for index, tmp in enumerate(serialized_data):
-        if tmp[-1] == identification:
-            footnote = serialized_data[index - 1]
-            if footnote[1] == "0" and footnote[2] == "1":
-                startframe = footnote[3]
-            output.append(append_frames(serialized_data, index, tmp, int(startframe), 0))
+    mask = np.zeros(len(order), dtype=bool)
+    mask[order[rank < per_cell]] = True
+    return mask
+
+
+def filter_tracks(ids, tracks, min_lifetime=0, max_error=0, cell_size=0, per_cell=0, step=1):
+    """thin out tracks for solvers, all filters work on the positions of all tracks at once
+    -   ids: track ids
+        tracks: structured arrays from parse_tracks
+        min_lifetime: drop tracks spanning fewer frames
+        max_error: drop positions with a higher error, 0 keeps all
+        cell_size, per_cell: keep per_cell positions per grid cell and frame, longest tracks first
+        step: keep only frames divisible by step
+    - returns ids and tracks that still have positions
+    """
+    if not tracks:
+        return ids, tracks
+
+    lengths = np.array([len(track) for track in tracks])
+    points = np.concatenate(tracks)
+    owner = np.repeat(np.arange(len(tracks)), lengths)
+    ends = np.cumsum(lengths)
+    lifetime = points["frame"][ends - 1] - points["frame"][ends - lengths] + 1
+
+    keep = lifetime[owner] >= min_lifetime
+    if max_error:
+        keep &= points["error"] <= max_error
+    if step > 1:
+        keep &= points["frame"] % step == 0
+    if cell_size and per_cell:
+        # positions dropped by the other filters don't take a cell's slot
+        candidates = np.flatnonzero(keep)
+        keep[candidates] = density_mask(
+            points[candidates], lifetime[owner[candidates]], cell_size, per_cell
+        )
+
+    counts = np.bincount(owner[keep], minlength=len(tracks))
+    survivors = counts > 0
+    if not survivors.any():
+        # np.split of no positions would still return one empty track
+        return ids[survivors], []
+
+    return ids[survivors], np.split(points[keep], np.cumsum(counts[survivors])[:-1])
+
+
+def filter_settings(node):
+    "keyword arguments of filter_tracks from the node's filter knobs, missing knobs don't filter"
+    settings = {}
+    for name, cast in [
+        ("min_lifetime", int),
+        ("max_error", float),
+        ("cell_size", int),
+        ("per_cell", int),
+        ("step", int),
+    ]:
+        if node.knob(name):
+            settings[name] = cast(node[name].value())
+
+    return settings
+
+
+def format_rows(fmt, *columns):
+    """format all rows of equally long columns in one go instead of line by line
+    -   fmt: printf style format of one row, including its line break
+        columns: arrays of the values per row
+    """
+    values = np.column_stack(columns).ravel().tolist()
+    return (fmt * len(columns[0])) % tuple(values)
+
+
+def write_pftrack(path, ids, tracks, size):
+    "PFTrack 2D tracks, frame x y and error in pixels"
+    with open(path, "w", buffering=1 << 20) as f:
+        for track_id, track in zip(ids.tolist(), tracks):
+            f.write(f'\n\n"Nuketrack_{track_id:04}"\n1\n{len(track)}\n')
+            f.write(
+                format_rows(
+                    "%d %.6f %.6f %.6f\n", track["frame"], track["x"], track["y"], track["error"]
+                )
+            )
+
+
+def write_3dequalizer(path, ids, tracks, size):
+    "3DEqualizer 2D tracking curves, frame x y in pixels"
+    with open(path, "w", buffering=1 << 20) as f:
+        f.write(f"{len(tracks)}\n")
+        for track_id, track in zip(ids.tolist(), tracks):
+            f.write(f"Nuketrack_{track_id:04}\n0\n{len(track)}\n")
+            f.write(format_rows("%d %.6f %.6f\n", track["frame"], track["x"], track["y"]))
 
-    return output
+
+def write_syntheyes(path, ids, tracks, size):
+    "SynthEyes 2D tracker paths, name frame u v with u, v from -1 to 1 and v pointing down"
+    width, height = size
+    with open(path, "w", buffering=1 << 20) as f:
+        for track_id, track in zip(ids.tolist(), tracks):
+            u = track["x"] / width * 2 - 1
+            v = 1 - track["y"] / height * 2
+            f.write(format_rows(f"Nuketrack_{track_id:04} %d %.6f %.6f\n", track["frame"], u, v))
+
+
+def write_npz(path, ids, tracks, size):
+    "columns of all tracks in one npz, split them again with lengths"
+    points = np.concatenate(tracks) if tracks else np.zeros(0, dtype=TRACK_DTYPE)
+    np.savez(
+        path,
+        ids=ids,
+        lengths=np.array([len(track) for track in tracks], dtype=np.int64),
+        size=np.array(size),
+        **{name: points[name] for name in TRACK_DTYPE.names},
+    )
+
+
+# export format: file extension and writer(path, ids, tracks, (width, height))
+EXPORTERS = {
+    "PFTrack": (".txt", write_pftrack),
+    "3DEqualizer": (".txt", write_3dequalizer),
+    "SynthEyes": (".txt", write_syntheyes),
+    "NumPy": (".npz", write_npz),
+}
+
+
+def script_name(script):
+    "script file name without version and extension"
+    basename = ntpath.basename(script)
+    i = basename.rfind("_v")
+    if i == -1:
+        return os.path.splitext(basename)[0]
+
+    return basename[:i]
+
+
+def export_filename(script, node_name, export_format, versioned=False):
+    """file name of an export, script name, node name and timestamp
+    -   versioned: keep the script's version, exports of several versions can share a folder
+    """
+    name = os.path.splitext(ntpath.basename(script))[0] if versioned else script_name(script)
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
+    extension = EXPORTERS[export_format][0]
+    return f"{name}_featuretracks_{export_format}_{node_name}_{timestamp}{extension}"
+
+
+def track_keys(ids, tracks):
+    """key per track from its first tracked frame and position, ids are only ordinals of a solve
+    - returns {track id: key}, repeated keys are numbered
+    """
+    keys = {}
+    seen = {}
+    for track_id, track in zip(ids.tolist(), tracks):
+        key = f"{track['frame'][0]}:{track['x'][0]:.3f}:{track['y'][0]:.3f}"
+        seen[key] = seen.get(key, 0) + 1
+        keys[track_id] = key if seen[key] == 1 else f"{key}:{seen[key]}"
+
+    return keys
+
+
+def track_hashes(tracks):
+    "sha1 of each track's frames, positions and errors"
+    return [hashlib.sha1(np.ascontiguousarray(track).tobytes()).hexdigest() for track in tracks]
+
+
+def incremental_export(folder, script, node_name, export_format, ids, tracks, keys, size):
+    """write only tracks added or changed since the last export of the node
+    a manifest next to the exports keeps content hash and exported id per track key,
+    tracks keep their exported id over re-solves, removed ids are listed in the manifest
+    -   folder: export folder
+        script: nk script, names the files, all versions of a script share one manifest,
+            so the first export of a new version is already a delta
+        node_name: CameraTracker name
+        export_format: key of EXPORTERS
+        ids, tracks: tracks to export, from parse_tracks or filter_tracks
+        keys: {track id: key} from track_keys
+        size: width and height of the node
+    - returns written file or None if nothing changed, and the delta of exported ids
+    """
+    manifest_path = os.path.join(
+        folder, f"{script_name(script)}_featuretracks_{export_format}_{node_name}.json"
+    )
+    manifest = {"revision": 0, "next_id": 1, "tracks": {}}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    previous = manifest["tracks"]
+    current = {}
+    delta = {"added": [], "changed": [], "removed": []}
+    written = []
+    for track_id, sha1 in zip(ids.tolist(), track_hashes(tracks)):
+        key = keys[track_id]
+        if key in previous:
+            export_id = previous[key]["id"]
+            if previous[key]["sha1"] != sha1:
+                delta["changed"].append(export_id)
+                written.append((export_id, len(current)))
+        else:
+            export_id = manifest["next_id"]
+            manifest["next_id"] += 1
+            delta["added"].append(export_id)
+            written.append((export_id, len(current)))
+        current[key] = {"id": export_id, "sha1": sha1}
+    delta["removed"] = sorted(v["id"] for k, v in previous.items() if k not in current)
+
+    if manifest["revision"] and not any(delta.values()):
+        return None, delta
+
+    name = node_name if not manifest["revision"] else f"{node_name}_delta{manifest['revision']:03}"
+    path = os.path.join(folder, export_filename(script, name, export_format, versioned=True))
+    os.makedirs(folder, exist_ok=True)
+    EXPORTERS[export_format][1](
+        path,
+        np.array([export_id for export_id, _ in written], dtype=np.int64),
+        [tracks[index] for _, index in written],
+        size,
+    )
+
+    manifest.update(revision=manifest["revision"] + 1, tracks=current, file=path, delta=delta)
+    # written aside and swapped in, a reader never sees a half written manifest
+    with tempfile.NamedTemporaryFile("w", dir=folder, suffix=".json", delete=False) as f:
+        json.dump(manifest, f)
+    os.replace(f.name, manifest_path)
+
+    return path, delta
 
 
 def file_create():
-    "write txt file for pfTrack to read"
+    "write feature tracks in the format chosen on the node, only changed tracks if incremental"
     n = nuke.thisNode()
     root_name = nuke.root().name()
-    exported_tracks = export_cameratrack(n)
-    counter = 1
+    export_format = n["export_format"].value() if n.knob("export_format") else "PFTrack"
+    writer = EXPORTERS[export_format][1]
+    parsed_ids, parsed_tracks = export_cameratrack(n)
+    ids, exported_tracks = filter_tracks(parsed_ids, parsed_tracks, **filter_settings(n))
     os.chdir(os.path.dirname(__file__))
     logpath = f"{os.path.dirname(root_name)}/export"
-    basename = ntpath.basename(root_name)
-    i = basename.rfind("_v")
-    if i == -1:
-        clean = os.path.splitext(basename)[0]
-    else:
-        clean = basename[:i]
-    filename = f'{clean}_featuretracks_{n.name()}_{datetime.now().strftime("%Y-%m-%d_%H-%M")}.txt'
-    txt_file = os.path.join(logpath, filename)
 
-    with open(txt_file, "w") as f:
-        for item in exported_tracks:
-            f.write("\n")
-            f.write("\n")
+    if n.knob("incremental") and n["incremental"].value():
+        path, delta = incremental_export(
+            logpath,
+            root_name,
+            n.name(),
+            export_format,
+            ids,
+            exported_tracks,
+            track_keys(parsed_ids, parsed_tracks),
+            (n.width(), n.height()),
+        )
+        if path is None:
+            nuke.message("no tracks changed since the last export, no file created")
+        else:
+            nuke.message(
+                f"file created: {os.path.basename(path)}\n{len(delta['added'])} added, "
+                + f"{len(delta['changed'])} changed, {len(delta['removed'])} removed"
+            )
+        return
+
+    filename = export_filename(root_name, n.name(), export_format)
 
-            f.write(f'"Nuketrack_{counter:04}"\n')
-            f.write("1\n")
-            f.write(f"{len(item)}\n")
-            for i in item:
-                line = "".join(str(i)[1:-1].split("'")) + "\n"
-                f.write(line.replace(",", ""))
+    writer(os.path.join(logpath, filename), ids, exported_tracks, (n.width(), n.height()))
 
-            counter += 1
+    nuke.message(f"file created: {filename}")
 
-    nuke.message(f"textfile created: {filename}")
 
 def create_knob():
     "create knob inside Cameratracker Node"
     n = nuke.thisNode()
-    usertab = nuke.Tab_Knob("User", "Export to PFTrack")
+    usertab = nuke.Tab_Knob("User", "Export Tracks")
+    format_knob = nuke.Enumeration_Knob("export_format", "format", list(EXPORTERS))
+    filter_knobs = [
+        nuke.Int_Knob("min_lifetime", "min lifetime"),
+        nuke.Double_Knob("max_error", "max error"),
+        nuke.Int_Knob("cell_size", "grid cell size"),
+        nuke.Int_Knob("per_cell", "tracks per cell"),
+        nuke.Int_Knob("step", "frame step"),
+    ]
+    filter_knobs[0].setTooltip("drop tracks spanning fewer frames")
+    filter_knobs[1].setTooltip("drop positions with a higher error, 0 keeps all")
+    filter_knobs[2].setTooltip("grid cell size in pixels for the density cap, 0 keeps all")
+    filter_knobs[3].setTooltip("positions kept per grid cell and frame, longest tracks first")
+    filter_knobs[4].setTooltip("keep only frames divisible by step")
+    filter_knobs[4].setValue(1)
+    incremental_knob = nuke.Boolean_Knob("incremental", "only changed tracks")
+    incremental_knob.setTooltip(
+        "write only tracks added or changed since the last export, removed ones are listed "
+        + "in the json manifest next to the exports, one manifest for all versions of the script"
+    )
+    incremental_knob.setFlag(nuke.STARTLINE)
     knob = nuke.PyScript_Knob(
         "setfeattrack",
         "Export Feature Tracks",
@@ -132,7 +419,14 @@ def create_knob():
     )
     if not n.knob("User"):
         n.addKnob(usertab)
+    if not n.knob("export_format"):
+        n.addKnob(format_knob)
+    for filter_knob in filter_knobs:
+        if not n.knob(filter_knob.name()):
+            n.addKnob(filter_knob)
+    if not n.knob("incremental"):
+        n.addKnob(incremental_knob)
     if not n.knob("setfeattrack"):
         n.addKnob(knob)
     if n.knob("attention"):
-        n.removeKnob("attention")
\ No newline at end of file
+        n.removeKnob("attention")
@@ -0,0 +1,295 @@
+"""
+Batch export feature tracks of every CameraTracker in many scripts
+* every .nk file found in a directory is opened by its own `nuke -t` worker
+* each CameraTracker Node's feature tracks are written like its Export Feature Tracks button does,
+  file names keep the script's version, existing files are never overwritten
+* exports go to an export folder next to each script or to one output directory,
+  a json report summarises the whole run
+* with --incremental only tracks changed since the last export are written, see incremental_export,
+  versions of one script share a manifest and are exported one after the other in version order
+
+usage: python cameratracker_batch.py <directory> [--output dir] [--workers 4] [--nuke nuke]
+                                     [--format PFTrack] [--min-lifetime 0] [--max-error 0]
+                                     [--cell-size 0] [--per-cell 0] [--step 1] [--incremental]
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+NUKE = os.environ.get("NUKE_EXE", "nuke")
+RESULT = "CAMERATRACKER_EXPORT_RESULT "  # marks the worker's summary line on stdout
+VERSION = re.compile(r"_v(\d+)")
+
+
+def find_scripts(directory):
+    "all nk scripts in directory and its subfolders"
+    scripts = []
+    for root, _, files in os.walk(directory):
+        scripts.extend(os.path.join(root, f) for f in sorted(files) if f.endswith(".nk"))
+
+    return scripts
+
+
+def version_number(script):
+    "last _v number of a script name, unversioned scripts come first"
+    versions = VERSION.findall(os.path.basename(script))
+    return int(versions[-1]) if versions else -1
+
+
+def script_groups(scripts, folders):
+    """scripts sharing an incremental export manifest, in version order
+    -   scripts: nk files
+        folders: {script: export folder}
+    - returns list of script lists, each list is exported by one worker after the other
+    """
+    from cameratracker import script_name
+
+    groups = {}
+    for script in scripts:
+        groups.setdefault((folders[script], script_name(script)), []).append(script)
+
+    return [sorted(group, key=version_number) for group in groups.values()]
+
+
+def export_folder(script, directory, output):
+    "export folder next to the script, or in the output directory with the same subfolders"
+    if output:
+        return os.path.join(output, os.path.dirname(os.path.relpath(script, directory)))
+
+    return os.path.join(os.path.dirname(script), "export")
+
+
+def export_script(script, target, export_format="PFTrack", filters=None, incremental=False):
+    """worker side, runs inside nuke -t
+    -   script: nk file to open
+        target: folder to write the track files to
+        export_format: key of cameratracker.EXPORTERS
+        filters: keyword arguments of cameratracker.filter_tracks
+        incremental: write only tracks added or changed since the last export
+    - returns summary of the export
+    """
+    import nuke
+    from cameratracker import (
+        EXPORTERS,
+        export_cameratrack,
+        export_filename,
+        filter_tracks,
+        incremental_export,
+        track_keys,
+    )
+
+    nuke.scriptOpen(script)
+    writer = EXPORTERS[export_format][1]
+    exported = []
+    empty = []
+    failed = {}
+
+    for tracker in nuke.allNodes("CameraTracker", recurseGroups=True):
+        full_name = tracker.fullName()
+        if not tracker["serializeKnob"].toScript().strip():
+            empty.append(full_name)
+            continue
+
+        try:
+            parsed_ids, parsed = export_cameratrack(tracker)
+        except (IndexError, ValueError) as err:
+            failed[full_name] = f"{type(err).__name__}: {err}"
+            continue
+
+        ids, tracks = filter_tracks(parsed_ids, parsed, **(filters or {}))
+        node_name = full_name.replace(".", "_")
+        size = (tracker.width(), tracker.height())
+        entry = {
+            "node": full_name,
+            "tracks": len(tracks),
+            "filtered_tracks": len(parsed) - len(tracks),
+            "points": sum(len(track) for track in tracks),
+        }
+        if incremental:
+            keys = track_keys(parsed_ids, parsed)
+            entry["file"], entry["delta"] = incremental_export(
+                target, script, node_name, export_format, ids, tracks, keys, size
+            )
+        else:
+            path = os.path.join(target, export_filename(script, node_name, export_format, True))
+            if os.path.exists(path):
+                # same script exported within the minute, keep the first one
+                failed[full_name] = f"{path} already exists"
+                continue
+            os.makedirs(target, exist_ok=True)
+            entry["file"] = path
+            writer(path, ids, tracks, size)
+        exported.append(entry)
+
+    return {
+        "script": script,
+        "format": export_format,
+        "exported": exported,
+        "empty": empty,
+        "failed_nodes": failed,
+    }
+
+
+def run_worker(script, target, nuke_exe, export_format="PFTrack", filters=None, incremental=False):
+    "start one nuke -t worker for a script and read back its summary"
+    cmd = [nuke_exe, "-t", os.path.abspath(__file__), "--worker", script, target]
+    cmd += ["--format", export_format]
+    for name, value in (filters or {}).items():
+        cmd += [f"--{name.replace('_', '-')}", str(value)]
+    if incremental:
+        cmd.append("--incremental")
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+    except OSError as err:
+        return {"script": script, "error": str(err)}
+
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT):
+            return json.loads(line[len(RESULT) :])
+
+    return {
+        "script": script,
+        "error": proc.stderr.strip()[-2000:] or f"exit code {proc.returncode}",
+    }
+
+
+def run_group(scripts, folders, nuke_exe, export_format="PFTrack", filters=None, incremental=False):
+    "export scripts one after the other, versions of a script never run in parallel"
+    return [
+        run_worker(s, folders[s], nuke_exe, export_format, filters, incremental) for s in scripts
+    ]
+
+
+def export_directory(
+    directory,
+    output=None,
+    workers=4,
+    nuke_exe=NUKE,
+    report=None,
+    export_format="PFTrack",
+    filters=None,
+    incremental=False,
+):
+    """export all CameraTrackers of all scripts of a directory in parallel nuke -t workers
+    - returns list of summaries, also written as json report
+    """
+    scripts = find_scripts(directory)
+    folders = {s: export_folder(s, directory, output) for s in scripts}
+    # versions of a script update one manifest when incremental, so they can't run in parallel
+    groups = script_groups(scripts, folders) if incremental else [[s] for s in scripts]
+    results = []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(run_group, group, folders, nuke_exe, export_format, filters, incremental)
+            for group in groups
+        ]
+        for future in as_completed(futures):
+            for result in future.result():
+                results.append(result)
+                if "error" in result:
+                    state = "failed"
+                else:
+                    state = f"{len(result['exported'])} tracker(s)"
+                print(f"{state:>16}  {result['script']}")
+
+    results.sort(key=lambda r: r["script"])
+    exported = [e for r in results for e in r.get("exported", [])]
+    summary = {
+        "directory": directory,
+        "format": export_format,
+        "filters": filters or {},
+        "incremental": incremental,
+        "scripts": len(scripts),
+        "exported_trackers": len(exported),
+        "unchanged_trackers": len([e for e in exported if not e["file"]]),
+        "exported_tracks": sum(e["tracks"] for e in exported),
+        "failed": [r["script"] for r in results if "error" in r],
+        "failed_nodes": [
+            f"{r['script']}: {node}" for r in results for node in r.get("failed_nodes", {})
+        ],
+        "results": results,
+    }
+
+    report = report or os.path.join(output or directory, "cameratracker_export_report.json")
+    os.makedirs(os.path.dirname(os.path.abspath(report)), exist_ok=True)
+    with open(report, "w") as f:
+        json.dump(summary, f, indent=4)
+
+    print(
+        f"{summary['exported_tracks']} tracks of {summary['exported_trackers']} CameraTracker(s) "
+        + f"in {summary['scripts']} scripts exported, {summary['unchanged_trackers']} unchanged, "
+        + f"{len(summary['failed'])} scripts and "
+        + f"{len(summary['failed_nodes'])} nodes failed. Report: {report}"
+    )
+    return results
+
+
+def main(argv=None):
+    "command line entry point"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from cameratracker import EXPORTERS
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("directory", nargs="?", help="folder with nk scripts")
+    parser.add_argument("--output", help="write all exports here instead of next to the scripts")
+    parser.add_argument("--workers", type=int, default=4, help="parallel nuke -t processes")
+    parser.add_argument("--nuke", default=NUKE, help="nuke executable, default $NUKE_EXE")
+    parser.add_argument("--report", help="json report, default in output or script folder")
+    parser.add_argument(
+        "--format", default="PFTrack", choices=list(EXPORTERS), help="track file format"
+    )
+    parser.add_argument(
+        "--min-lifetime", type=int, default=0, help="drop shorter tracks, in frames"
+    )
+    parser.add_argument(
+        "--max-error", type=float, default=0, help="drop positions with a higher error, 0 keeps all"
+    )
+    parser.add_argument(
+        "--cell-size", type=int, default=0, help="grid cell size in pixels for the density cap"
+    )
+    parser.add_argument(
+        "--per-cell", type=int, default=0, help="positions per grid cell and frame, 0 keeps all"
+    )
+    parser.add_argument("--step", type=int, default=1, help="keep only frames divisible by step")
+    parser.add_argument(
+        "--incremental", action="store_true", help="write only tracks changed since the last export"
+    )
+    parser.add_argument("--worker", nargs=2, metavar=("SCRIPT", "TARGET"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    filters = {
+        "min_lifetime": args.min_lifetime,
+        "max_error": args.max_error,
+        "cell_size": args.cell_size,
+        "per_cell": args.per_cell,
+        "step": args.step,
+    }
+
+    if args.worker:
+        print(
+            RESULT + json.dumps(export_script(*args.worker, args.format, filters, args.incremental))
+        )
+        return
+
+    if not args.directory:
+        parser.error("directory is required")
+
+    export_directory(
+        args.directory,
+        args.output,
+        args.workers,
+        args.nuke,
+        args.report,
+        args.format,
+        filters,
+        args.incremental,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Cryptomatte Coverage
+screen area of every matte of a Cryptomatte layer over a frame range, read from the exr files
+* only the layer's id and coverage channels are decoded, summed per id with NumPy
+* frames are read in a worker pool, all ranks of all frames are accumulated in one pass
+* mattes are listed by screen area, to find big offenders or tiny slivers
+opened from the Cryptomatte Panel of customise_cryptomatte.py
+"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+from PySide2 import QtWidgets, QtCore
+
+try:
+    import Imath
+    import OpenEXR
+except ImportError:
+    # the panel disables coverage statistics without it
+    OpenEXR = None
+
+COLUMNS = ["Matte", "Area (px)", "Screen %", "Frames", "Area / Frame (px)"]
+
+
+def rank_channels(channels, layer):
+    """id and coverage channel pairs of a layer, in rank order
+    -   channels: channel names of the exr
+        layer: Cryptomatte layer name, like CryptoObject
+    - returns list of (id channel, coverage channel)
+    """
+    pattern = re.compile(re.escape(layer) + r"\d\d$")
+    levels = sorted(
+        set(c.rpartition(".")[0] for c in channels if pattern.match(c.rpartition(".")[0]))
+    )
+    pairs = []
+    for level in levels:
+        pairs.append((f"{level}.R", f"{level}.G"))
+        pairs.append((f"{level}.B", f"{level}.A"))
+
+    return [pair for pair in pairs if pair[0] in channels and pair[1] in channels]
+
+
+def read_ranks(path, layer):
+    """decode only the rank channels of a layer
+    - returns ids as uint32 float bits, coverage as float32 and the pixel count of the frame
+    """
+    exr = OpenEXR.InputFile(path)
+    try:
+        pairs = rank_channels(exr.header()["channels"], layer)
+        raw = exr.channels(
+            [c for pair in pairs for c in pair], Imath.PixelType(Imath.PixelType.FLOAT)
+        )
+    finally:
+        exr.close()
+
+    if not raw:
+        return np.zeros(0, np.uint32), np.zeros(0, np.float32), 0
+
+    ids = np.concatenate([np.frombuffer(i, np.uint32) for i in raw[0::2]])
+    coverage = np.concatenate([np.frombuffer(i, np.float32) for i in raw[1::2]])
+    return ids, coverage, len(raw[0]) // 4
+
+
+def sum_coverage(ids, coverage):
+    """coverage summed per id, a pixel partly covered by an id counts partly
+    - returns unique ids and their area in pixels
+    """
+    mask = coverage > 0
+    unique, inverse = np.unique(ids[mask], return_inverse=True)
+    return unique, np.bincount(inverse, weights=coverage[mask], minlength=len(unique))
+
+
+def frame_coverage(path, layer):
+    "area per id of one exr, with its pixel count"
+    ids, coverage, pixels = read_ranks(path, layer)
+    unique, area = sum_coverage(ids, coverage)
+    return unique, area, pixels
+
+
+def merge_coverage(frames):
+    """accumulate the areas of many frames
+    -   frames: list of frame_coverage results
+    - returns unique ids, total area, number of frames and mean pixel count per frame
+    """
+    if not frames:
+        return np.zeros(0, np.uint32), np.zeros(0), np.zeros(0, np.int64), 0
+
+    ids = np.concatenate([f[0] for f in frames])
+    unique, inverse = np.unique(ids, return_inverse=True)
+    area = np.bincount(inverse, weights=np.concatenate([f[1] for f in frames]))
+    count = np.bincount(inverse, minlength=len(unique))
+    return unique, area, count, float(np.mean([f[2] for f in frames]))
+
+
+class CoverageModel(QtCore.QAbstractTableModel):
+    """coverage table backed by NumPy arrays, sorting is one argsort"""
+
+    def __init__(self, names, area, count, pixels, parent=None):
+        super(CoverageModel, self).__init__(parent)
+        self.names = np.array(names, dtype=object)
+        self.columns = [
+            self.names,
+            area,
+            area / count / max(pixels, 1) * 100,
+            count,
+            area / count,
+        ]
+        self.order = np.arange(len(names))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.order)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return COLUMNS[section]
+
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        value = self.columns[index.column()][self.order[index.row()]]
+        if role == QtCore.Qt.DisplayRole:
+            if index.column() == 0:
+                return value
+            if index.column() == 3:
+                return str(int(value))
+            return f"{value:.4f}" if index.column() == 2 else f"{value:.1f}"
+        if role == QtCore.Qt.TextAlignmentRole and index.column():
+            return int(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+
+        return None
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self.order = np.argsort(self.columns[column], kind="stable")
+        if order == QtCore.Qt.DescendingOrder:
+            self.order = self.order[::-1]
+        self.layoutChanged.emit()
+
+    def name(self, row):
+        "matte name of a view row"
+        return self.names[self.order[row]]
+
+
+class CoverageDialog(QtWidgets.QDialog):
+    """mattes of a layer sorted by screen area
+    -   layer: Cryptomatte layer name
+        matte_ids: {integer id: name} to resolve ids, unknown ids are shown as hex
+        select: called with a matte name on double click
+    """
+
+    def __init__(self, layer, matte_ids, select=None, parent=None):
+        super(CoverageDialog, self).__init__(parent)
+        self.layer = layer
+        self.matte_ids = matte_ids
+        self.select = select
+
+        self.setWindowTitle(f"{layer} Coverage")
+        self.resize(720, 640)
+        layout = QtWidgets.QVBoxLayout()
+        self.setLayout(layout)
+
+        self.summary = QtWidgets.QLabel(self)
+        layout.addWidget(self.summary)
+
+        self.table = QtWidgets.QTableView(self)
+        self.table.setSortingEnabled(True)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.doubleClicked.connect(self.select_row)
+        self.table.setToolTip("double click to select the matte in available Mattes")
+        layout.addWidget(self.table)
+
+    def run(self, paths):
+        """read all frames in a worker pool and fill the table
+        - returns False if cancelled
+        """
+        progress = QtWidgets.QProgressDialog(
+            "Reading coverage", "Cancel", 0, len(paths), self.parentWidget()
+        )
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.show()
+
+        pool = ThreadPoolExecutor()
+        futures = [pool.submit(frame_coverage, path, self.layer) for path in paths]
+        pending = futures
+        while pending:
+            pending = wait(pending, timeout=0.05).not_done
+            progress.setValue(len(paths) - len(pending))
+            QtWidgets.QApplication.processEvents()
+            if progress.wasCanceled():
+                # don't wait for the reads in flight, their results are dropped
+                for future in pending:
+                    future.cancel()
+                pool.shutdown(wait=False)
+                progress.close()
+                return False
+
+        pool.shutdown()
+        progress.close()
+        ids, area, count, pixels = merge_coverage([f.result() for f in futures])
+        names = [self.matte_ids.get(i, f"{i:08x}") for i in ids.tolist()]
+        model = CoverageModel(names, area, count, pixels, self.table)
+        self.table.setModel(model)
+        self.table.sortByColumn(1, QtCore.Qt.DescendingOrder)
+        self.table.resizeColumnToContents(0)
+        self.summary.setText(
+            f"{len(names)} mattes in {len(paths)} frames of {int(pixels)} pixels, "
+            + "area is summed coverage over all frames"
+        )
+        return True
+
+    def select_row(self, index):
+        if self.select:
+            self.select(self.table.model().name(index.row()))
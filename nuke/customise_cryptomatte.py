@@ -8,20 +8,29 @@ easlily select Cryptomatte Elements from a Qt Panel, when they are hard to pick
 """
 
 import ast
+import bisect
+import hashlib
+import json
+import os
 import re
+import struct
+import tempfile
 import traceback
 import fnmatch
+from collections import OrderedDict
 
 import nuke
 import nukescripts
 from PySide2 import QtWidgets, QtCore
 
+import cryptomatte_coverage
+
 STYLESHEET = """
 QWidget {
     background: #333;
     color: #ccc;
 }
-QListView, QTreeWidget {
+QListView, QTreeView {
     border: 3px inset #262626;
     padding: 3 5 3 5;
 }
@@ -48,39 +57,524 @@ QLabel {
 """
 
 
-class ListViewWidget(QtWidgets.QListWidget):
-    """custom ListWidget for custom Event Handling"""
+class LRUCache(object):
+    """dictionary keeping only the most recently used entries
+    - maxsize: number of entries kept
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        "entry of key, marked as recently used"
+        if key not in self.entries:
+            return default
+
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        "store entry, the least recently used ones are dropped beyond maxsize"
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+# parsed manifests by (layer, hash of raw metadata), shared between all panels, a panel keeps
+# references to the manifests it shows, so dropping them here never breaks an open panel
+MANIFEST_CACHE = LRUCache(16)
+# {integer id: name} of the cached manifests, built on first pick
+ID_CACHE = LRUCache(16)
+FRAME_RANGE = re.compile(r"(-?\d+)(?:-(-?\d+))?")
+TCL_SPECIAL = re.compile(r'([\\"$\[\]{}])')
+# "name": "hex id" of a flat json manifest, names may contain escaped characters
+MANIFEST_PAIR = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"\s*:\s*"([0-9a-fA-F]*)"', re.S)
+
+
+def parse_manifest(raw):
+    "manifest metadata to {name: hex id}, json first and python literal as fallback"
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return ast.literal_eval(raw)
+
+
+def manifest_digest(raw):
+    "hash of raw manifest metadata, identical manifests share one cache entry"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def parse_sorted(raw):
+    "parsed manifest and its sorted names, as stored in MANIFEST_CACHE"
+    manifest = parse_manifest(raw)
+    return manifest, sorted(manifest)
+
+
+def sidecar_digest(path):
+    "cache key of a sidecar manifest file, changes whenever the file gets rewritten"
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def iter_manifest_file(path, chunk_size=1 << 22):
+    """stream the name, hex id pairs of a json sidecar manifest
+    the file is read chunk by chunk, so only the parsed names are kept in memory
+    """
+    with open(path, encoding="utf-8") as f:
+        tail = ""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+
+            buffer = tail + chunk
+            end = 0
+            for match in MANIFEST_PAIR.finditer(buffer):
+                name, hex_id = match.groups()
+                if "\\" in name:
+                    name = json.decoder.scanstring(f'"{name}"', 1)[0]
+                yield name, hex_id
+                end = match.end()
+            tail = buffer[end:]  # a pair cut by the chunk border
+
+    if tail.strip(" \t\r\n{,}"):
+        raise ValueError(f"unterminated manifest {path}")
+
+
+def parse_sorted_file(path):
+    "parsed sidecar manifest and its sorted names, as stored in MANIFEST_CACHE"
+    manifest = dict(iter_manifest_file(path))
+    return manifest, sorted(manifest)
+
+
+def cached_manifest(layer, source, digest=None, parse=parse_sorted):
+    """parse manifest only once per layer and content
+    -   source: raw manifest metadata, or sidecar path with parse=parse_sorted_file
+        digest: manifest_digest of raw or sidecar_digest of path, if already known
+    - returns manifest dictionary and its sorted names
+    """
+    key = (layer, digest or manifest_digest(source))
+    parsed = MANIFEST_CACHE.get(key)
+    if parsed is None:
+        parsed = parse(source)
+        MANIFEST_CACHE.put(key, parsed)
+
+    return parsed
+
+
+def float_id(value):
+    "sampled id channel value as integer of its float32 bits, the manifest's hex hash"
+    return struct.unpack("<I", struct.pack("<f", value))[0]
+
+
+def cached_ids(key, manifest):
+    """{integer id: name} of a manifest, inverted only once
+    -   key: (layer, digest) of the manifest
+        manifest: {name: hex id}
+    """
+    ids = ID_CACHE.get(key)
+    if ids is None:
+        ids = {}
+        for name, hex_id in manifest.items():
+            try:
+                ids[int(hex_id, 16)] = name
+            except (TypeError, ValueError):
+                continue  # not a hash, nothing to pick
+        ID_CACHE.put(key, ids)
+
+    return ids
+
+
+def bits_to_ranges(bits, first):
+    "frame bitset as run-length frame ranges, like 1-20 25 30-40"
+    ranges = []
+    frame = first
+    while bits:
+        skip = (bits & -bits).bit_length() - 1
+        run = ((bits >> skip) ^ ((bits >> skip) + 1)).bit_length() - 1
+        start = frame + skip
+        ranges.append(f"{start}-{start + run - 1}" if run > 1 else f"{start}")
+        bits >>= skip + run
+        frame = start + run
+
+    return " ".join(ranges)
+
+
+def ranges_to_bits(ranges, first):
+    "run-length frame ranges back to a frame bitset starting at first"
+    bits = 0
+    for match in FRAME_RANGE.finditer(ranges):
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        bits |= ((1 << (end - start + 1)) - 1) << (start - first)
+
+    return bits
+
+
+class FrameOccupancy:
+    """frames each matte was found in the manifest, as int bitsets with bit 0 on first
+    stored as run-length ranges on the node, so the panel needs no re-scan of the metadata
+    """
+
+    def __init__(self, first, bits=None):
+        self.first = first
+        self.bits = bits or {}  # name: frame bitset
+
+    def add(self, names, frame_bits):
+        "mark names as present on all frames of a bitset"
+        for name in names:
+            self.bits[name] = self.bits.get(name, 0) | frame_bits
+
+    def present(self, frame):
+        "names present on a frame"
+        if frame < self.first:
+            return set([])
+
+        bit = 1 << (frame - self.first)
+        return set(name for name, bits in self.bits.items() if bits & bit)
+
+    def first_frame(self, name):
+        "first frame a matte is present on, None if it never is"
+        bits = self.bits.get(name, 0)
+        if not bits:
+            return None
+
+        return self.first + (bits & -bits).bit_length() - 1
+
+    def to_dict(self):
+        return {
+            "first": self.first,
+            "mattes": {name: bits_to_ranges(bits, self.first) for name, bits in self.bits.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        first = data["first"]
+        return cls(first, {n: ranges_to_bits(r, first) for n, r in data["mattes"].items()})
+
+
+def compile_matte_list(items, trie):
+    """resolve wildcards and "-" exclusions of matteList items against the manifest once
+    - returns deduplicated explicit names, Cryptomatte then doesn't match patterns on every cook
+    """
+    added = {}
+    removed = set([])
+    for item in items:
+        name = item[1:] if item.startswith("-") else item
+        names = trie.expand(name) if "*" in name else [name]
+        if item.startswith("-"):
+            removed.update(names)
+        else:
+            added.update(dict.fromkeys(names))
+
+    return [name for name in added if name not in removed]
+
+
+def tcl_quote(value):
+    "knob value for a nk script, braces keep it literal unless it contains braces itself"
+    if "{" in value or "}" in value or value.endswith("\\"):
+        return '"' + TCL_SPECIAL.sub(r"\\\1", value) + '"'
+
+    return "{" + value + "}"
+
+
+def cryptomatte_script(nodes, layer):
+    """nk script of Cryptomatte nodes, all connected to the node selected when pasting
+    -   nodes: list of (matte list, label, xpos, ypos)
+        layer: cryptoLayerChoice of all nodes
+    """
+    lines = ["set cut_paste_input [stack 0]"]
+    for matte_list, label, xpos, ypos in nodes:
+        lines += [
+            "push $cut_paste_input",
+            "Cryptomatte {",
+            f" matteList {tcl_quote(matte_list)}",
+            f" cryptoLayerChoice {tcl_quote(layer)}",
+            f" label {tcl_quote(label)}",
+            f" xpos {xpos}",
+            f" ypos {ypos}",
+            "}",
+        ]
+
+    return "\n".join(lines) + "\n"
+
+
+class ManifestNode:
+    "single path element of a ManifestTrie"
+
+    __slots__ = ("children", "leaf")
+
+    def __init__(self):
+        self.children = {}
+        self.leaf = False
+
+
+class ManifestTrie:
+    """path trie of manifest names, built once per manifest
+    wildcards like prefix/* expand by walking the subtree instead of matching all names
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.root = ManifestNode()
+        self.search_index = None
+        for name in names:
+            node = self.root
+            for part in name.split("/"):
+                child = node.children.get(part)
+                if child is None:
+                    child = node.children[part] = ManifestNode()
+                node = child
+            node.leaf = True
+
+    def find(self, path):
+        "node of a path, None if it isn't in the manifest"
+        node = self.root
+        for part in path.split("/"):
+            node = node.children.get(part)
+            if node is None:
+                return None
+
+        return node
+
+    def leaves(self, node, prefix):
+        "all names below a node"
+        stack = [(node, prefix)]
+        while stack:
+            node, prefix = stack.pop()
+            for part, child in node.children.items():
+                path = f"{prefix}/{part}"
+                if child.leaf:
+                    yield path
+                if child.children:
+                    stack.append((child, path))
+
+    def get_search_index(self):
+        "substring index over the node names, built on first search"
+        if self.search_index is None:
+            self.search_index = SearchIndex(self)
+
+        return self.search_index
+
+    def expand(self, pattern):
+        "manifest names matching a wildcard"
+        prefix = pattern[:-2]
+        if pattern.endswith("/*") and not any(c in prefix for c in "*?["):
+            node = self.find(prefix)
+            return [] if node is None else list(self.leaves(node, prefix))
+
+        return [name for name in self.names if fnmatch.fnmatchcase(name, pattern)]
+
+
+class SearchIndex:
+    """substring index over the node names of a ManifestTrie, case insensitive
+    unique names are joined into one corpus, so a query is a str.find over it instead of
+    a python loop over every tree item, a query extending the previous one only checks its matches
+    """
+
+    def __init__(self, trie):
+        self.paths = {}  # lower case node name: paths of all nodes with that name
+        stack = [(trie.root, "")]
+        while stack:
+            node, prefix = stack.pop()
+            for part, child in node.children.items():
+                path = f"{prefix}/{part}" if prefix else part
+                self.paths.setdefault(part.lower(), []).append(path)
+                if child.children:
+                    stack.append((child, path))
+
+        self.names = sorted(self.paths)
+        self.corpus = "\n".join(self.names)
+        self.starts = []
+        offset = 0
+        for name in self.names:
+            self.starts.append(offset)
+            offset += len(name) + 1
+
+        self.last_query = None
+        self.last_names = []
+
+    def names_containing(self, text):
+        "scan the corpus, jumping to the next name after every hit"
+        found = []
+        pos = self.corpus.find(text)
+        while pos != -1:
+            index = bisect.bisect_right(self.starts, pos) - 1
+            found.append(self.names[index])
+            if index + 1 == len(self.starts):
+                break
+            pos = self.corpus.find(text, self.starts[index + 1])
+
+        return found
+
+    def search(self, text):
+        "paths of all nodes whose name contains text"
+        text = text.lower()
+        if self.last_query is not None and self.last_query in text:
+            names = [name for name in self.last_names if text in name]
+        else:
+            names = self.names_containing(text)
+
+        self.last_query = text
+        self.last_names = names
+        for name in names:
+            yield from self.paths[name]
+
+
+class SelectedMattesModel(QtCore.QAbstractListModel):
+    """selected mattes of every layer, only the current layer is shown
+    rows are backed by a set, so membership tests while dragging don't depend on the list size
+    """
+
+    def __init__(self, parent=None):
+        super(SelectedMattesModel, self).__init__(parent)
+        self.layers = {}  # layer: list of names in row order
+        self.layer = ""
+        self.rows = self.layers.setdefault(self.layer, [])
+        self.members = set([])
+
+    def set_layer(self, layer):
+        "show the stored selection of a layer"
+        self.beginResetModel()
+        self.layer = layer
+        self.rows = self.layers.setdefault(layer, [])
+        self.members = set(self.rows)
+        self.endResetModel()
+
+    def set_names(self, names):
+        "replace the current layer's selection"
+        self.beginResetModel()
+        self.rows[:] = dict.fromkeys(names)
+        self.members = set(self.rows)
+        self.endResetModel()
+
+    def contains_all(self, names):
+        "check if every name is already selected"
+        return self.members.issuperset(names)
+
+    def add_names(self, names, row=-1):
+        """insert new names in one batch, names already selected are skipped
+        -   names: list of names in the order to insert
+            row: insert before this row, -1 appends
+        """
+        new = [name for name in dict.fromkeys(names) if name not in self.members]
+        if not new:
+            return
+
+        if row < 0 or row > len(self.rows):
+            row = len(self.rows)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row + len(new) - 1)
+        self.rows[row:row] = new
+        self.members.update(new)
+        self.endInsertRows()
+
+    def remove_rows(self, rows):
+        "remove rows, neighbouring rows are removed as one range"
+        rows = sorted(set(rows))
+        while rows:
+            last = first = rows.pop()
+            while rows and rows[-1] == first - 1:
+                first = rows.pop()
+
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            self.members.difference_update(self.rows[first : last + 1])
+            del self.rows[first : last + 1]
+            self.endRemoveRows()
+
+    def remove_names(self, names):
+        "remove names from the current layer's selection"
+        names = self.members.intersection(names)
+        self.remove_rows([row for row, name in enumerate(self.rows) if name in names])
+
+    def toggle_subtract(self, row):
+        "switch a name between adding and subtracting, drops the row if that name exists already"
+        name = self.rows[row]
+        toggled = name[1:] if name.startswith("-") else f"-{name}"
+        if toggled in self.members:
+            self.remove_rows([row])
+            return
+
+        self.members.discard(name)
+        self.members.add(toggled)
+        self.rows[row] = toggled
+        index = self.index(row, 0)
+        self.dataChanged.emit(index, index)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and role == QtCore.Qt.DisplayRole:
+            return self.rows[index.row()]
+
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.ItemIsDropEnabled
+
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsDragEnabled
+
+
+class ListViewWidget(QtWidgets.QListView):
+    """custom ListView for custom Event Handling"""
 
     def __init__(self, parent=None):
         super(ListViewWidget, self).__init__(parent)
 
         self.parent_widget = parent
         self.stored_items = []
+        self.proposed_cache = None  # (drag state, proposed items) while dragging
         self.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
         self.setDragDropMode(QtWidgets.QAbstractItemView.DragDrop)
-        self.model().rowsInserted.connect(self.on_rowinserted)
+        self.setUniformItemSizes(True)
+        self.setModel(SelectedMattesModel(self))
 
-    def on_rowinserted(self, parent, first, last):
-        "add row to parent widget layer"
-        selected_layer = self.parent_widget.layer_choice.currentText()
-        for i in range(first, last + 1):
-            try:
-                self.parent_widget.layer_item_selection[selected_layer].add(self.item(i).text())
-            except KeyError:
-                self.parent_widget.layer_item_selection[selected_layer] = set([self.item(i).text()])
+    def names(self):
+        "all selected mattes of the current layer, in list order"
+        return list(self.model().rows)
+
+    def selected_rows(self):
+        "highlighted rows in list order, read from the selection ranges"
+        rows = set([])
+        for selection_range in self.selectionModel().selection():
+            rows.update(range(selection_range.top(), selection_range.bottom() + 1))
+
+        return sorted(rows)
+
+    def selected_names(self):
+        "names of the highlighted rows, in list order"
+        return [self.model().rows[row] for row in self.selected_rows()]
+
+    def clear(self):
+        "remove all mattes of the current layer"
+        self.model().set_names([])
 
     def proposed_new_items(self, event):
-        "selected TreeItems to be dropped in ListWidget"
+        "selected TreeItems to be dropped in ListWidget, memoized while the drag lasts"
         source = event.source()
         mod_keys = event.keyboardModifiers()
-        source_items = source.selectedItems()
+        if isinstance(source, TreeViewWidget):
+            source_items = source.selected_paths()
+        else:
+            source_items = source.selected_names()
+
+        drag_state = (source, int(mod_keys), source_items)
+        if self.proposed_cache and self.proposed_cache[0] == drag_state:
+            return self.proposed_cache[1]
+
+        trie = self.parent_widget.get_manifest_trie()
         new_items = []
 
-        for item in source_items:
-            try:
-                source_item = item.toolTip(0)  # QTreeWidget
-            except TypeError:
-                source_item = item.text()  # QListWidget
+        for source_item in source_items:
             if source_item.endswith("*"):
                 if mod_keys & QtCore.Qt.ControlModifier:
                     if mod_keys & QtCore.Qt.AltModifier:
@@ -89,19 +583,20 @@ class ListViewWidget(QtWidgets.QListWidget):
                         new_items.append(source_item)
                     continue
 
-                for entity in self.parent_widget.gathered_manifest:
-                    if fnmatch.fnmatchcase(entity, source_item):
-                        if mod_keys == QtCore.Qt.AltModifier:
-                            new_items.append(f"-{entity}")
-                        else:
-                            new_items.append(entity)
+                for entity in trie.expand(source_item):
+                    if mod_keys == QtCore.Qt.AltModifier:
+                        new_items.append(f"-{entity}")
+                    else:
+                        new_items.append(entity)
             else:
                 if mod_keys & QtCore.Qt.AltModifier:
                     new_items.append(f"-{source_item}")
                 else:
                     new_items.append(source_item)
 
-        return sorted(new_items)
+        new_items.sort()
+        self.proposed_cache = (drag_state, new_items)
+        return new_items
 
     def dragMoveEvent(self, event):
         "forbit insert if item exists"
@@ -109,121 +604,213 @@ class ListViewWidget(QtWidgets.QListWidget):
             event.setAccepted(True)
             return
 
-        exists = True
-        for item in self.proposed_new_items(event):
-            if not self.findItems(item, QtCore.Qt.MatchExactly):
-                exists = False
-                break
-
-        event.setAccepted(not exists)
+        event.setAccepted(not self.model().contains_all(self.proposed_new_items(event)))
 
     def dropEvent(self, event):
         "drop item in selected bin"
         event.setDropAction(QtCore.Qt.CopyAction)
         if event.source() == self:
-            new_items = [i.text() for i in self.stored_items]
+            new_items = self.stored_items
         else:
             new_items = self.proposed_new_items(event)
-        row = self.indexFromItem(self.itemAt(event.pos())).row()
-        for item in new_items:
-            if self.findItems(item, QtCore.Qt.MatchExactly):
-                continue
-            if row == -1:
-                self.addItem(item)
-            else:
-                self.insertItem(row, item)
+        self.proposed_cache = None
+        self.model().add_names(new_items, self.indexAt(event.pos()).row())
         event.setAccepted(True)
 
     def dragLeaveEvent(self, event):
         "throw items out of the list"
-        self.stored_items = self.selectedItems()
-        for row in self.stored_items:
-            self.takeItem(self.row(row))
-            try:
-                self.parent_widget.layer_item_selection[
-                    self.parent_widget.layer_choice.currentText()
-                ].remove(row.text())
-            except KeyError:
-                pass  # double list item element fuck up
+        self.proposed_cache = None
+        self.stored_items = self.selected_names()
+        self.model().remove_rows(self.selected_rows())
         event.setAccepted(True)
 
     def mouseDoubleClickEvent(self, event):
-        item = self.itemAt(event.pos())
-        label = item.text()
-        if label.startswith("-"):
-            item.setText(label[1:])
-        else:
-            item.setText(f"-{label}")
+        index = self.indexAt(event.pos())
+        if index.isValid():
+            self.model().toggle_subtract(index.row())
 
     def keyPressEvent(self, event):
         "delete with del and backspace key"
         if event.key() in [QtCore.Qt.Key_Delete, QtCore.Qt.Key_Backspace]:
-            selected_layer = self.parent_widget.layer_choice.currentText()
-            for row in self.selectedItems():
-                self.takeItem(self.row(row))
-                try:
-                    self.parent_widget.layer_item_selection[selected_layer].remove(row.text())
-                except KeyError:
-                    pass  # double list item element fuck up
+            self.model().remove_rows(self.selected_rows())
         super(ListViewWidget, self).keyPressEvent(event)
 
 
-class TreeViewWidget(QtWidgets.QTreeWidget):
-    """custom TreeWidget to (among others) modify expand recursively on Alt+MouseClick"""
+class MatteEntry:
+    "row of the available mattes tree, either a matte or a wildcard over a node's children"
+
+    __slots__ = ("name", "path", "node", "wildcard", "parent", "row", "children")
+
+    def __init__(self, name, path, node, wildcard, parent, row):
+        self.name = name
+        self.path = path
+        self.node = node
+        self.wildcard = wildcard
+        self.parent = parent
+        self.row = row
+        self.children = None  # created on first expand
+
+
+class MatteTreeModel(QtCore.QAbstractItemModel):
+    """lazy model over a ManifestTrie
+    rows of a branch are only created when it gets expanded
+    """
+
+    def __init__(self, parent=None):
+        super(MatteTreeModel, self).__init__(parent)
+        self.root = MatteEntry("", "", ManifestNode(), True, None, 0)
+        self.root.children = []
+
+    def set_trie(self, trie):
+        "show a new manifest, only top level rows are created"
+        self.beginResetModel()
+        self.root = MatteEntry("", "", trie.root, True, None, 0)
+        self.root.children = self.make_entries(self.root)
+        self.endResetModel()
+
+    def make_entries(self, parent):
+        "rows below a wildcard, a node with children shows up as matte and as wildcard"
+        entries = []
+        prefix = parent.path[:-2]
+        for name in sorted(parent.node.children):
+            node = parent.node.children[name]
+            path = f"{prefix}/{name}" if prefix else name
+            if node.leaf:
+                entries.append(MatteEntry(name, path, node, False, parent, len(entries)))
+            if node.children:
+                entries.append(MatteEntry(name, f"{path}/*", node, True, parent, len(entries)))
+
+        return entries
+
+    def entry(self, index):
+        "MatteEntry of an index, root entry for the invalid index"
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        children = self.entry(parent).children
+        if column != 0 or not children or not 0 <= row < len(children):
+            return QtCore.QModelIndex()
+
+        return self.createIndex(row, column, children[row])
+
+    def parent(self, index=None):
+        if index is None:
+            return super(MatteTreeModel, self).parent()  # QObject.parent
+        if not index.isValid():
+            return QtCore.QModelIndex()
+
+        parent = index.internalPointer().parent
+        if parent is self.root:
+            return QtCore.QModelIndex()
+
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+
+        return len(self.entry(parent).children or [])
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        return self.entry(parent).wildcard
+
+    def canFetchMore(self, parent):
+        entry = self.entry(parent)
+        return entry.wildcard and entry.children is None
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return  # already fetched, replacing children would drop rows behind the views' back
+
+        entry = self.entry(parent)
+        entries = self.make_entries(entry)
+        entry.children = []  # canFetchMore is False from here on, views may ask while inserting
+        if not entries:
+            return
+
+        self.beginInsertRows(parent, 0, len(entries) - 1)
+        entry.children = entries
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return index.internalPointer().name
+        if role == QtCore.Qt.ToolTipRole:
+            return index.internalPointer().path
+
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsDragEnabled
+
+    def index_for_path(self, path):
+        "index of a matte or wildcard path, collapsed branches on the way are fetched"
+        wildcard = path.endswith("/*")
+        parts = (path[:-2] if wildcard else path).split("/")
+        index = QtCore.QModelIndex()
+
+        for depth, part in enumerate(parts):
+            if self.canFetchMore(index):
+                self.fetchMore(index)
+            want_wildcard = wildcard or depth < len(parts) - 1
+            for child in self.entry(index).children:
+                if child.name == part and child.wildcard == want_wildcard:
+                    break
+            else:
+                return QtCore.QModelIndex()
+            index = self.createIndex(child.row, 0, child)
+
+        return index
+
+
+class TreeViewWidget(QtWidgets.QTreeView):
+    """custom TreeView to (among others) modify expand recursively on Alt+MouseClick"""
 
     def __init__(self, parent=None):
         super(TreeViewWidget, self).__init__(parent)
-        self.headerItem().setHidden(True)
+        self.setHeaderHidden(True)
+        self.setUniformRowHeights(True)
         self.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
 
         self.setExpandsOnDoubleClick(True)
         self.setDragDropMode(QtWidgets.QAbstractItemView.DragOnly)
+        self.setModel(MatteTreeModel(self))
 
-    def makeTreeWidgetItems(self, root, parent=""):
-        items = []
-        for k, v in sorted(root.items()):
-            if "leaf" in v.keys():
-                del v["leaf"]
-                item = QtWidgets.QTreeWidgetItem([k])
-                tooltip = f'{parent.strip("/*")}/{k}'.strip("/")
-                item.setToolTip(0, tooltip)
-                items.append(item)
-            if v:
-                item = QtWidgets.QTreeWidgetItem([k])
-                tooltip = f'{parent.strip("/*")}/{k}/*'.strip("/")
-                item.setToolTip(0, tooltip)
-                items.append(item)
-                # Alembic/tho_pos_timeoffset/thorvaldson/GEO_ship/Geo_pos_light_red_back
-                children = self.makeTreeWidgetItems(v, tooltip)
-                for child in children:
-                    items[-1].addChild(child)
-
-        return items
-
-    def toggle_expansion(self, item, expand):
-        "expand or flatten whole list on alt+click"
-        item.setExpanded(expand)
-        for c in range(item.childCount()):
-            self.toggle_expansion(item.child(c), expand)
+    def set_manifest(self, trie):
+        "show manifest trie, replacing the current tree"
+        self.model().set_trie(trie)
 
-    def expandSelection(self):
-        for item in self.selectedItems():
-            item.setExpanded(True)
+    def selected_paths(self):
+        "manifest paths (tooltips) of all selected rows"
+        return [i.data(QtCore.Qt.ToolTipRole) for i in self.selectionModel().selectedRows()]
 
-    def makeTree(self, items):
-        root = {}
-        for path in [f"{i}/leaf" for i in items]:
-            parent = root
-            for n in path.split("/"):
-                parent = parent.setdefault(n, {})
+    def toggle_expansion(self, index, expand):
+        "expand or flatten whole list on alt+click"
+        model = self.model()
+        self.setExpanded(index, expand)
+        if expand and model.canFetchMore(index):
+            model.fetchMore(index)
+        for row in range(model.rowCount(index)):
+            self.toggle_expansion(model.index(row, 0, index), expand)
 
-        return self.makeTreeWidgetItems(root)
+    def expandSelection(self):
+        for index in self.selectionModel().selectedRows():
+            self.setExpanded(index, True)
 
     def mousePressEvent(self, event):
         super(TreeViewWidget, self).mousePressEvent(event)
         if event.modifiers() == QtCore.Qt.AltModifier:
-            item = self.itemAt(event.pos())
-            self.toggle_expansion(item, item.isExpanded())
+            index = self.indexAt(event.pos())
+            if index.isValid():
+                self.toggle_expansion(index, self.isExpanded(index))
 
 
 class CustomNodeKnob(QtWidgets.QWidget):
@@ -269,9 +856,15 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
         super(CryptomatteUserfriendlyMode, self).__init__(parent)
         self.node = node
 
-        self.layer_item_selection = {}
         self.matte_on_open = {}
         self.node_knob = None
+        self.gathered_manifest = []
+        self.manifest_trie = None
+        self.manifests = {}  # (layer, digest): parsed manifest of all in gathered_manifest
+        self.scanned = False  # manifests come from a frame range scan, not a single frame
+        self.compile_trie = None
+        self.matte_ids = None
+        self.occupancy = None  # {layer: FrameOccupancy}, loaded from the node on first use
 
         # Dialog settings
         self.setWindowTitle(self.node.name())
@@ -300,14 +893,113 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
                     self.layer_selection[matte_id] = {}
                 self.layer_selection[matte_id][partial_key] = v
 
-    def gather_manifest(self, frame=0):
-        "gather manifest metadata, containing the shape dictionary"
+    def layer_prefix(self):
+        "metadata prefix of the chosen layer"
         choice = self.layer_choice.currentText()
         if not self.layer_selection:
             self.gather_layer()
         selection = [k for k, v in self.layer_selection.items() if v.get("name", "") == choice]
 
-        key = f"exr/cryptomatte/{selection[0]}/manifest"
+        return f"exr/cryptomatte/{selection[0]}/"
+
+    def manifest_source(self, prefix, time):
+        """inline manifest metadata or manif_file sidecar of a layer, relative to the exr
+        - returns cache digest, parse function and its source, digest is None without manifest
+        """
+        raw = self.node.metadata(prefix + "manifest", time)
+        if raw:
+            return manifest_digest(raw), parse_sorted, raw
+
+        manif_file = self.node.metadata(prefix + "manif_file", time)
+        if not manif_file:
+            return None, None, None
+
+        exr = self.node.metadata("input/filename", time) or ""
+        path = os.path.join(os.path.dirname(exr), manif_file)
+        try:
+            return sidecar_digest(path), parse_sorted_file, path
+        except OSError:
+            print(traceback.format_exc())
+            return None, None, None
+
+    def filter_names(self, names):
+        "apply panel options to sorted manifest names"
+        if self.current_frame_only.isChecked():
+            occupancy = self.get_occupancy().get(self.layer_choice.currentText())
+            if occupancy:
+                present = occupancy.present(nuke.frame())
+                names = [i for i in names if i in present]
+
+        if self.vray_lights.isChecked():
+            return names
+
+        return [i for i in names if not i.split("/")[-1].lower().startswith("vraylight")]
+
+    def get_occupancy(self):
+        "frame occupancy of all scanned layers, read from the node's hidden knob"
+        if self.occupancy is None:
+            knob = self.node.knob("cfx_occupancy")
+            data = json.loads(knob.value()) if knob and knob.value() else {}
+            self.occupancy = {k: FrameOccupancy.from_dict(v) for k, v in data.items()}
+
+        return self.occupancy
+
+    def store_occupancy(self, layer, occupancy):
+        "replace a layer's frame occupancy, stored on the node to survive the session"
+        self.get_occupancy()[layer] = occupancy
+        knob = self.node.knob("cfx_occupancy")
+        if not knob:
+            knob = nuke.String_Knob("cfx_occupancy", "")
+            knob.setFlag(nuke.INVISIBLE)
+            self.node.addKnob(knob)
+
+        knob.setValue(json.dumps({k: v.to_dict() for k, v in self.occupancy.items()}))
+
+    def go_to_first_frame(self):
+        "set the current frame to the first frame any selected matte is present on"
+        occupancy = self.get_occupancy().get(self.layer_choice.currentText())
+        if not occupancy:
+            nuke.message("Scan a Framerange first to know where mattes are.")
+            self.activateWindow()
+            return
+
+        trie = self.get_manifest_trie()
+        frames = []
+        for path in self.available_mattes.selected_paths():
+            for name in trie.expand(path) if path.endswith("*") else [path]:
+                frames.append(occupancy.first_frame(name))
+
+        frames = [i for i in frames if i is not None]
+        if not frames:
+            nuke.message("Selected mattes weren't found in the scanned Framerange.")
+            self.activateWindow()
+            return
+
+        nuke.frame(min(frames))
+
+    def get_manifest_trie(self):
+        "path trie of gathered manifest, only rebuilt when the manifest changed"
+        if self.manifest_trie is None or self.manifest_trie.names is not self.gathered_manifest:
+            self.manifest_trie = ManifestTrie(self.gathered_manifest)
+
+        return self.manifest_trie
+
+    def get_compile_trie(self):
+        """path trie of all names of the gathered manifests, without panel filters
+        wildcards are compiled against it, so hidden VRayLights or mattes missing on the
+        current frame aren't dropped from the matteList
+        """
+        if self.compile_trie is None:
+            names = set([])
+            for _, manifest_names in self.manifests.values():
+                names.update(manifest_names)
+            self.compile_trie = ManifestTrie(sorted(names))
+
+        return self.compile_trie
+
+    def gather_manifest(self, frame=0):
+        "gather manifest metadata, containing the shape dictionary"
+        choice = self.layer_choice.currentText()
 
         if frame == 0:
             time = nuke.frame()
@@ -315,118 +1007,281 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
             time = nuke.frame(frame)
 
         try:
-            items_dict = ast.literal_eval(self.node.metadata(key, time))
-            if not self.vray_lights.isChecked():
-                list_items = [
-                    i
-                    for i in items_dict.keys()
-                    if not i.split("/")[-1].lower().startswith("vraylight")
-                ]
-            else:
-                list_items = items_dict.keys()
+            digest, parse, source = self.manifest_source(self.layer_prefix(), time)
+            if digest is None:
+                self.gathered_manifest = []
+                self.set_manifests({})
+                return []
 
-        except IndexError:
+            parsed = cached_manifest(choice, source, digest, parse)
+            names = parsed[1]
+            list_items = self.filter_names(names)
+
+        except (IndexError, ValueError):
             print(traceback.format_exc())
             return []
 
         else:
-            self.gathered_manifest = sorted(list_items)
-            return sorted(list_items)
+            self.gathered_manifest = list_items
+            self.set_manifests({(choice, digest): parsed})
+            return list_items
+
+    def set_manifests(self, manifests, scanned=False):
+        """keep the gathered manifests for picking and compiling, independent of MANIFEST_CACHE
+        -   manifests: {(layer, digest): parsed manifest}
+            scanned: manifests of a frame range scan, wildcards can only be compiled then
+        """
+        self.manifests = manifests
+        self.scanned = scanned
+        self.compile_trie = None
+        self.matte_ids = None
+        self.compile_list.setEnabled(scanned)
+
+    def get_matte_ids(self):
+        "{integer id: name} of all gathered manifests"
+        if self.matte_ids is None:
+            if len(self.manifests) == 1:
+                key, (manifest, _) = next(iter(self.manifests.items()))
+                self.matte_ids = cached_ids(key, manifest)
+            else:
+                self.matte_ids = {}
+                for key, (manifest, _) in sorted(self.manifests.items()):
+                    self.matte_ids.update(cached_ids(key, manifest))
+
+        return self.matte_ids
 
     def gather_framerange(self):
-        "gather manifest from framerange to have possible shapes (with names)"
+        """gather manifest from framerange to have possible shapes (with names)
+        identical manifests of different frames are parsed only once, parsing holds the GIL,
+        so skipping the duplicates is what makes long ranges fast
+        """
         p = nukescripts.FrameRangePanel(nuke.root().firstFrame(), nuke.root().lastFrame())
-        p.showDialog()
+        if not p.showDialog():
+            return
 
-        tmp_manifest = set([])
+        try:
+            prefix = self.layer_prefix()
+        except IndexError:
+            print(traceback.format_exc())
+            return
+
+        layer = self.layer_choice.currentText()
         start = p.fromFrame.value()
         finish = p.toFrame.value() + 1
-        progress = QtWidgets.QProgressDialog()
-        progress.setRange(start, finish)
-        progress.canceled.connect(self.gather_manifest)
-        progress.open()
+        progress = QtWidgets.QProgressDialog("Reading metadata", "Cancel", start, finish, self)
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.show()
 
+        frame_bits = {}  # digest: bitset of frames using that manifest
+        manifests = {}
+        pending = {}  # digest: parse function and source of manifests not cached yet
         for frame in range(start, finish):
-            progress.setLabelText(f"Processing frame {frame}")
+            progress.setLabelText(f"Reading frame {frame}")
             progress.setValue(frame)
-            for item in self.gather_manifest(frame):
-                tmp_manifest.add(item)
+            QtWidgets.QApplication.processEvents()
+            if progress.wasCanceled():
+                return
+
+            digest, parse, source = self.manifest_source(prefix, frame)
+            if digest is None:
+                continue
+
+            frame_bits[digest] = frame_bits.get(digest, 0) | 1 << (frame - start)
+            if digest not in pending and (layer, digest) not in manifests:
+                cached = MANIFEST_CACHE.get((layer, digest))
+                if cached is None:
+                    pending[digest] = (parse, source)
+                else:
+                    manifests[(layer, digest)] = cached
 
-        self.gathered_manifest = sorted(list(tmp_manifest))
+        progress.setRange(0, len(pending))
+        for i, (digest, (parse, source)) in enumerate(pending.items()):
+            progress.setLabelText(f"Parsing unique manifest {i + 1} of {len(pending)}")
+            progress.setValue(i)
+            QtWidgets.QApplication.processEvents()
+            if progress.wasCanceled():
+                return
+
+            manifests[(layer, digest)] = cached_manifest(layer, source, digest, parse)
+
+        tmp_manifest = set([])
+        occupancy = FrameOccupancy(start)
+        for digest, bits in frame_bits.items():
+            names = manifests[(layer, digest)][1]
+            tmp_manifest.update(names)
+            occupancy.add(names, bits)
+
+        progress.close()
+        self.store_occupancy(layer, occupancy)
+        self.gathered_manifest = self.filter_names(sorted(tmp_manifest))
+        self.set_manifests(manifests, scanned=True)
         self.update_ui(False)
 
     def highlight_selected(self, view):
         "temporarily set values of selected Items in matteList Knob"
         for matte in [self.available_mattes, self.selected_mattes]:
             if view != matte:
-                for item in matte.selectedItems():
-                    matte.setItemSelected(item, False)
-
-        if isinstance(view, QtWidgets.QTreeWidget):
-            self.node["matteList"].setValue(
-                ", ".join([re.sub("(?<!^)-", "\\\\-", i.toolTip(0)) for i in view.selectedItems()])
-            )
+                # deselect silently, otherwise the other view would overwrite matteList again
+                matte.selectionModel().blockSignals(True)
+                matte.clearSelection()
+                matte.selectionModel().blockSignals(False)
+                matte.viewport().update()
+
+        if view is self.available_mattes:
+            items = view.selected_paths()
         else:
-            self.node["matteList"].setValue(
-                ", ".join([re.sub("(?<!^)-", "\\\\-", i.text()) for i in view.selectedItems()])
-            )
-
-    def create_new_cryptonodes(self):
-        "create new nodes for each selected TreeViewItem"
-        dot = self.create_dotnode()
-        for item in self.available_mattes.selectedItems():
-            cryptonode = self.create_cryptonode(item.toolTip(0))
-            cryptonode["label"].setValue(f"{item.toolTip(0)}")  # \n[value cryptoLayerChoice]")
+            items = view.selected_names()
+
+        self.node["matteList"].setValue(self.matte_list(items))
+
+    def matte_list(self, items):
+        "matteList value of items, compiled to explicit names if chosen"
+        if self.compile_list.isChecked() and self.scanned:
+            items = compile_matte_list(items, self.get_compile_trie())
+
+        return ", ".join([re.sub("(?<!^)-", "\\\\-", i) for i in items])
+
+    def sample_position(self):
+        "pixel position of the active viewer's colour sample (ctrl+click)"
+        viewer = nuke.activeViewer()
+        if not viewer:
+            return None
+
+        bbox = viewer.node()["colour_sample_bbox"].value()
+        fmt = self.node.format()
+        aspect = float(fmt.width()) / fmt.height() * fmt.pixelAspect()
+        x = (bbox[0] * 0.5 + 0.5) * fmt.width()
+        y = (bbox[1] * 0.5 + 0.5 / aspect) * aspect * fmt.height()
+        return x, y
+
+    def id_channels(self):
+        "(id, coverage) channel pairs of the chosen layer, in rank order"
+        pattern = re.compile(re.escape(self.layer_choice.currentText()) + r"\d\d$")
+        layers = sorted(set(c.split(".")[0] for c in self.node.channels()))
+        pairs = []
+        for layer in [i for i in layers if pattern.match(i)]:
+            pairs.append((f"{layer}.red", f"{layer}.green"))
+            pairs.append((f"{layer}.blue", f"{layer}.alpha"))
+
+        return pairs
+
+    def pick_matte(self):
+        "select the matte with the highest coverage at the viewer's colour sample"
+        position = self.sample_position()
+        if not position:
+            nuke.message("Ctrl+click the pixel to pick in a Viewer first.")
+            self.activateWindow()
+            return
 
-        nuke.delete(dot)
+        matte_ids = self.get_matte_ids()
+        samples = []
+        for id_channel, coverage_channel in self.id_channels():
+            coverage = self.node.sample(coverage_channel, *position)
+            if coverage > 0:
+                samples.append((coverage, float_id(self.node.sample(id_channel, *position))))
+
+        for _, matte_id in sorted(samples, reverse=True):
+            if matte_id in matte_ids:
+                self.select_matte(matte_ids[matte_id])
+                return
+
+        nuke.message(f"No matte of {self.layer_choice.currentText()} found at {position}.")
+        self.activateWindow()
+
+    def select_matte(self, name):
+        "select, expand to and scroll to a matte in available mattes"
+        view = self.available_mattes
+        model = view.model()
+        index = model.index_for_path(name)
+        if not index.isValid():
+            nuke.message(f"{name} is hidden by the current options.")
+            self.activateWindow()
+            return
 
-    def create_one_cryptonode(self):
-        "create one new node for all selected TreeViewItems"
-        dot = self.create_dotnode()
-        matte_list = ", ".join([i.toolTip(0) for i in self.available_mattes.selectedItems()])
+        self.search_timer.stop()
+        self.searchbar.blockSignals(True)
+        self.searchbar.clear()
+        self.searchbar.blockSignals(False)
+        self.show_searchitems()
+
+        parent = index.parent()
+        while parent.isValid():
+            view.expand(parent)
+            parent = parent.parent()
+        view.selectionModel().select(
+            index, QtCore.QItemSelectionModel.ClearAndSelect | QtCore.QItemSelectionModel.Rows
+        )
+        view.scrollTo(index)
 
-        cryptonode = self.create_cryptonode(matte_list)
+    def show_coverage(self):
+        "screen area of the chosen layer's mattes over a frame range, read from the exr files"
+        if cryptomatte_coverage.OpenEXR is None:
+            nuke.message("Coverage statistics need the OpenEXR python module.")
+            self.activateWindow()
+            return
 
-        cryptonode["label"].setValue(
-            f"{matte_list.split(', ', maxsplit=1)[0]} et al"  # \n[value cryptoLayerChoice]"
-        )
-        nuke.delete(dot)
+        p = nukescripts.FrameRangePanel(nuke.root().firstFrame(), nuke.root().lastFrame())
+        if not p.showDialog():
+            return
 
-    def create_dotnode(self):
-        "create Dot Node for following Cryptomattes to hang in"
-        if not self.available_mattes.selectedItems():
-            nuke.message("You don't have anything selected!")
+        frames = range(p.fromFrame.value(), p.toFrame.value() + 1)
+        paths = [self.node.metadata("input/filename", frame) for frame in frames]
+        paths = list(dict.fromkeys(i for i in paths if i))
+        if not paths:
+            nuke.message("No exr files found to read coverage from.")
             self.activateWindow()
             return
 
-        _ = [n.setSelected(False) for n in nuke.allNodes()]
+        dialog = cryptomatte_coverage.CoverageDialog(
+            self.layer_choice.currentText(), self.get_matte_ids(), self.select_matte, self
+        )
+        if dialog.run(paths):
+            dialog.exec_()
 
-        dot_node = nuke.nodes.Dot()
-        dot_node.setInput(0, self.node.input(0))
-        dot_node.setSelected(True)
-        dot_node.setXYpos(self.node.xpos() + 110, self.node.ypos())
-        return dot_node
+    def create_new_cryptonodes(self):
+        "create new nodes for each selected TreeViewItem"
+        paths = self.available_mattes.selected_paths()
+        self.paste_cryptonodes([(self.matte_list([path]), path) for path in paths])
 
-    def create_cryptonode(self, matte_list):
-        "create node with settings from multiple or single button"
-        cryptonode = nuke.createNode("Cryptomatte")
-        cryptonode.setInput(0, self.node.input(0))
-        # cryptonode.setXpos(self.node.xpos() + 110)
-        # cryptonode.setYpos(self.node.ypos() + (index * 50))
-        # cryptonode.autoplace()
-        cryptonode["matteList"].setValue(matte_list)
-        cryptonode["cryptoLayerChoice"].setValue(self.layer_choice.currentText())
-        cryptonode.hideControlPanel()
+    def create_one_cryptonode(self):
+        "create one new node for all selected TreeViewItems"
+        paths = self.available_mattes.selected_paths()
+        self.paste_cryptonodes([(self.matte_list(paths), f"{paths[0]} et al")] if paths else [])
+
+    def paste_cryptonodes(self, nodes, columns=10):
+        """create all Cryptomatte nodes from one generated script, in a single undo step
+        the nodes are laid out in a grid next to this node and hang on its input
+        -   nodes: list of (matte list, label)
+            columns: nodes per row
+        """
+        if not nodes:
+            nuke.message("You don't have anything selected!")
+            self.activateWindow()
+            return
 
-        return cryptonode
+        xpos = self.node.xpos() + 110
+        ypos = self.node.ypos() + 60
+        placed = [
+            (matte_list, label, xpos + (i % columns) * 110, ypos + (i // columns) * 60)
+            for i, (matte_list, label) in enumerate(nodes)
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".nk", delete=False) as f:
+            f.write(cryptomatte_script(placed, self.layer_choice.currentText()))
+
+        undo = nuke.Undo()
+        undo.begin(f"Create {len(nodes)} Cryptomatte(s)")
+        try:
+            _ = [n.setSelected(False) for n in nuke.selectedNodes()]
+            if self.node.input(0):
+                self.node.input(0).setSelected(True)
+            nuke.nodePaste(f.name)
+        finally:
+            undo.end()
+            os.remove(f.name)
 
     def okay_sanitycheck(self):
         "check if selected Matte List is empty"
-        items = []
-        for i in range(self.selected_mattes.count()):
-            items.append(self.selected_mattes.item(i))
-
-        if not items:
+        if not self.selected_mattes.names():
             if nuke.ask("There are no items in selected Mattes.\n\nWas that intentional?"):
                 self.accept()
             else:
@@ -437,13 +1292,7 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
     def dialog_closed(self, state):
         "if okay, set matteListe with new values, if cancel return to opening state"
         if state:
-            items = []
-            for i in range(self.selected_mattes.count()):
-                items.append(self.selected_mattes.item(i))
-
-            self.node["matteList"].setValue(
-                ", ".join([re.sub("(?<!^)-", "\\\\-", i.text()) for i in items])
-            )
+            self.node["matteList"].setValue(self.matte_list(self.selected_mattes.names()))
         else:
             self.node["matteList"].setValue(self.matte_on_open["list"])
             self.node["cryptoLayerChoice"].setValue(int(self.matte_on_open["layer"]))
@@ -462,7 +1311,12 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
         self.searchbar = QtWidgets.QLineEdit()
         self.searchbar.setPlaceholderText("search...")
         self.searchbar.setSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Preferred)
-        self.searchbar.textChanged.connect(self.show_searchitems)
+        # wait for a typing pause instead of searching on every keystroke
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+        self.search_timer.timeout.connect(self.show_searchitems)
+        self.searchbar.textChanged.connect(lambda: self.search_timer.start())
         self.main_layout.addWidget(self.searchbar, 1, 3, 1, 2)
 
         self.available_label = QtWidgets.QLabel("available Mattes", self)
@@ -470,7 +1324,7 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
         self.main_layout.addWidget(self.available_label, 0, 2)
 
         self.available_mattes = TreeViewWidget(self)
-        self.available_mattes.itemSelectionChanged.connect(
+        self.available_mattes.selectionModel().selectionChanged.connect(
             lambda: self.highlight_selected(self.available_mattes)
         )
         self.main_layout.addWidget(self.available_mattes, 2, 0, 1, 5)  # 0-4
@@ -497,6 +1351,13 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
         self.b_collapse.clicked.connect(self.available_mattes.collapseAll)
         self.main_layout.addWidget(self.b_collapse, 4, 4)
 
+        self.b_pick = QtWidgets.QPushButton("Pick from Viewer")
+        self.b_pick.clicked.connect(self.pick_matte)
+        self.b_pick.setToolTip(
+            "Select the matte at the Viewer's colour sample, Ctrl+click a pixel in a Viewer first."
+        )
+        self.main_layout.addWidget(self.b_pick, 4, 3)
+
         self.vray_lights = QtWidgets.QCheckBox("include VRayLights")
         self.vray_lights.toggled.connect(self.delete_obsolete)
         self.main_layout.addWidget(self.vray_lights, 4, 0)
@@ -512,6 +1373,27 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
         self.b_gatherfr.clicked.connect(self.gather_framerange)
         self.main_layout.addWidget(self.b_gatherfr, 5, 4)
 
+        self.b_first_frame = QtWidgets.QPushButton("Go to first Frame")
+        self.b_first_frame.clicked.connect(self.go_to_first_frame)
+        self.b_first_frame.setToolTip(
+            "Jump to the first frame a selected matte is present on, needs a scanned Framerange."
+        )
+        self.main_layout.addWidget(self.b_first_frame, 5, 3)
+
+        self.current_frame_only = QtWidgets.QCheckBox("current Frame only")
+        self.current_frame_only.setToolTip(
+            "Only show mattes present on the current frame, needs a scanned Framerange."
+        )
+        self.current_frame_only.toggled.connect(self.refilter_mattes)
+        self.main_layout.addWidget(self.current_frame_only, 6, 4)
+
+        self.b_coverage = QtWidgets.QPushButton("Coverage Stats")
+        self.b_coverage.clicked.connect(self.show_coverage)
+        self.b_coverage.setToolTip(
+            "List the mattes of a Framerange by screen area, read from the exr files."
+        )
+        self.main_layout.addWidget(self.b_coverage, 6, 3)
+
         self.b_single_cryptonode = QtWidgets.QPushButton("Create 1 Cryptomatte\nfrom Selection")
         self.b_single_cryptonode.setToolTip(
             "Create one single new Cryptomatte Node for all selected Items from available Mattes."
@@ -539,7 +1421,7 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
         self.main_layout.addWidget(self.selected_label, 0, 7)
 
         self.selected_mattes = ListViewWidget(self)
-        self.selected_mattes.itemSelectionChanged.connect(
+        self.selected_mattes.selectionModel().selectionChanged.connect(
             lambda: self.highlight_selected(self.selected_mattes)
         )
         self.main_layout.addWidget(self.selected_mattes, 2, 5, 1, 5)  # 5-9
@@ -548,6 +1430,15 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
         self.clear_selection.clicked.connect(self.selected_mattes.clear)
         self.main_layout.addWidget(self.clear_selection, 3, 9)
 
+        self.compile_list = QtWidgets.QCheckBox("compile Wildcards")
+        self.compile_list.setToolTip(
+            "Write wildcards and subtracted items as the explicit matte names they resolve to, "
+            + "so Cryptomatte doesn't match them against the manifest on every cook. "
+            + "Needs a scanned Framerange, mattes outside of it aren't included."
+        )
+        self.compile_list.setEnabled(False)
+        self.main_layout.addWidget(self.compile_list, 3, 5, 1, 2)
+
         # Dialog Buttons
         self.button_box = QtWidgets.QDialogButtonBox()
         self.button_box.setStandardButtons(
@@ -577,73 +1468,67 @@ class CryptomatteUserfriendlyMode(QtWidgets.QDialog):
         self.layer_choice.addItems(self.node["cryptoLayerChoice"].values())
         self.layer_choice.setCurrentIndex(self.matte_on_open["layer"])
 
-        self.selected_mattes.clear()
-        self.selected_mattes.addItems([i for i in self.matte_on_open["list"].split(", ") if i])
+        self.selected_mattes.model().set_names(
+            [i for i in self.matte_on_open["list"].split(", ") if i]
+        )
         self.update_ui()
 
     def set_prev_selection(self, value):
         "restore saved items when changing layers"
         if not value:
             return
-        self.selected_mattes.clear()
-        self.selected_mattes.addItems(list(self.layer_item_selection.get(value, [])))
+        self.selected_mattes.model().set_layer(value)
         self.delete_obsolete()
 
-    def find_parent(self, child):
-        "recursive find tree item parent"
-        parent = child.parent()
-        if not parent:
-            return child
-        else:
-            parent.setExpanded(True)
-            return self.find_parent(parent)
-
     def show_searchitems(self):
-        "search in tree view"
-        self.available_mattes.collapseAll()
-        if self.searchbar.text():
-            matches = self.available_mattes.findItems(
-                self.searchbar.text(), QtCore.Qt.MatchContains | QtCore.Qt.MatchRecursive
-            )
+        "search in tree view, expanding the branches of all matches"
+        view = self.available_mattes
+        model = view.model()
+        top = QtCore.QModelIndex()
+        text = self.searchbar.text()
 
-            # all_items = self.available_mattes.findItems("", QtCore.Qt.MatchContains)
-            # print(len(all_items))
+        view.collapseAll()
+        for row in range(model.rowCount(top)):
+            view.setRowHidden(row, top, bool(text))
 
-            for i in range(self.available_mattes.topLevelItemCount()):
-                self.available_mattes.topLevelItem(i).setHidden(True)
+        if not text:
+            return
 
-            # for i in all_items:
-            #     i.setHidden(True)
+        shown = set([])
+        branches = set([])
+        for path in self.get_manifest_trie().get_search_index().search(text):
+            parts = path.split("/")
+            shown.add(parts[0])
+            branches.update("/".join(parts[:depth]) + "/*" for depth in range(1, len(parts)))
 
-            for m in matches:
-                p = self.find_parent(m)
-                p.setHidden(False)
-                # m.setHidden(False)
+        for branch in sorted(branches):
+            view.expand(model.index_for_path(branch))
 
-        else:
-            for i in range(self.available_mattes.topLevelItemCount()):
-                self.available_mattes.topLevelItem(i).setHidden(False)
+        for row in range(model.rowCount(top)):
+            if model.index(row, 0, top).data() in shown:
+                view.setRowHidden(row, top, False)
 
     def delete_obsolete(self):
         "remove obsolete items according to settings"
         self.update_ui()
-        to_remove = []
-        for i in range(self.selected_mattes.count()):
-            item = self.selected_mattes.item(i)
-            if item.text() not in self.gathered_manifest:
-                to_remove.append(item)
+        manifest = set(self.gathered_manifest)
+        self.selected_mattes.model().remove_names(
+            [i for i in self.selected_mattes.names() if i not in manifest]
+        )
 
-        for item in to_remove:
-            self.layer_item_selection[self.layer_choice.currentText()].remove(item.text())
-            self.selected_mattes.takeItem(self.selected_mattes.row(item))
+    def refilter_mattes(self):
+        "apply the view filters to the gathered manifests again, selected mattes stay untouched"
+        names = set([])
+        for _, manifest_names in self.manifests.values():
+            names.update(manifest_names)
+        self.gathered_manifest = self.filter_names(sorted(names))
+        self.available_mattes.set_manifest(self.get_manifest_trie())
 
     def update_ui(self, update_manifest=True):
         "update available mattes according to settings"
-        self.available_mattes.clear()
         if update_manifest:
             self.gather_manifest()
-        crypto_layer = self.available_mattes.makeTree(self.gathered_manifest)
-        self.available_mattes.addTopLevelItems(crypto_layer)
+        self.available_mattes.set_manifest(self.get_manifest_trie())
         self.node["cryptoLayerChoice"].setValue(self.layer_choice.currentIndex())
         self.node_knob.findChild(QtWidgets.QCheckBox, "vraylights").setChecked(
             self.vray_lights.isChecked()
@@ -5,8 +5,53 @@ https://forum.highend3d.com/t/euler-filter-algorithm/6147
 last updated 2024 (code cleanup)
 """
 
-import nuke
-import nukescripts
+try:
+    import nuke
+    import nukescripts
+except ImportError:
+    # filter core stays usable without Nuke, see euler_filter_benchmark.py
+    nuke = None
+
+
+def rotation_axes(ro):
+    "indices of x, y and z for rotation order"
+    return [ro.find("X"), ro.find("Y"), ro.find("Z")]
+
+
+def unwrap(prev, value):
+    "value shifted by whole turns to be closest to prev"
+    return value + 360 * round((prev - value) / 360)
+
+
+def fix_frame(prev, curr, xyz):
+    """remove flips of current rotation relative to the previous one
+    a rotation has a second euler solution, outer axes +180 and middle axis 180 - middle,
+    of both the one closest to the previous frame is kept, after removing whole turns
+    -   prev: already filtered rotation of previous frame
+        curr: rotation of current frame
+        xyz: axis indices from rotation_axes
+    - returns filtered rotation of current frame
+    """
+    middle = xyz.index(1)
+    mirrored = [value + 180 for value in curr]
+    mirrored[middle] = 180 - curr[middle]
+
+    candidates = [[unwrap(p, c) for p, c in zip(prev, rotation)] for rotation in (curr, mirrored)]
+    return min(candidates, key=lambda c: sum(abs(p - v) for p, v in zip(prev, c)))
+
+
+def filter_rotation(values, ro):
+    """filter a list of rotations without touching any knob
+    -   values: rotations per frame, the first one is only used as reference
+        ro: rotation order
+    - returns filtered rotations, including the reference
+    """
+    xyz = rotation_axes(ro)
+    filtered = [list(values[0])]
+    for curr in values[1:]:
+        filtered.append(fix_frame(filtered[-1], curr, xyz))
+
+    return filtered
 
 
 def euler_filter(first, last, ro, kopie):
@@ -30,7 +75,7 @@ def euler_filter(first, last, ro, kopie):
     else:
         nuke.thisNode()["label"].setValue("Euler Filter")
 
-    xyz = [ro.find("X"), ro.find("Y"), ro.find("Z")]
+    xyz = rotation_axes(ro)
 
     for i in range(first, last + 1):
         if progress.isCancelled():
@@ -45,34 +90,49 @@ def euler_filter(first, last, ro, kopie):
         curr = k.valueAt(i)
         prev = k.valueAt(i - 1)
 
-        if (
-            round(abs(prev[xyz[0]] - curr[xyz[0]])) > 90
-            and round(abs(prev[xyz[1]] - curr[xyz[1]])) > 90
-            and round(abs(prev[xyz[2]] - curr[xyz[2]])) > 90
-        ):
-            for axis in xyz:
-                if prev[axis] < curr[axis]:
-                    k.setValueAt(curr[axis] - 180, i, axis)
-                else:
-                    k.setValueAt(curr[axis] + 180, i, axis)
-
-        for axis in xyz:
-            if round(abs(prev[axis] - curr[axis])) > 270:
-                if prev[axis] < curr[axis]:
-                    k.setValueAt(curr[axis] - 360, i, axis)
-                else:
-                    k.setValueAt(curr[axis] + 360, i, axis)
+        for axis, value in enumerate(fix_frame(prev, curr, xyz)):
+            if value != curr[axis]:
+                k.setValueAt(value, i, axis)
+
+    del progress
+
+
+def bake_knob(knob, first, last):
+    """bake all axes of a knob in a single sampling pass
+    -   knob: XYZ knob, animated or driven by an expression
+        first, last: framerange to bake
+    - returns False if the user cancelled, knob stays untouched then
+    """
+    progress = nuke.ProgressTask("Baking curves")
+    samples = []
+
+    for i in range(first, last + 1):
+        if progress.isCancelled():
+            del progress
+            return False
+
+        norm = (i - first) * 100 / max(last - first, 1)
+        progress.setProgress(int(norm))
+        progress.setMessage(f"Frame: {i}")
+
+        # one evaluation per frame returns x, y and z together
+        samples.append((i, knob.valueAt(i)))
 
     del progress
 
+    knob.clearAnimated()
+    knob.setAnimated()
+    for axis, curve in enumerate(knob.animations()[:3]):
+        curve.addKey([nuke.AnimationKey(frame, value[axis]) for frame, value in samples])
+
+    return True
+
 
 def euler_fix():
     "bake animation and prepare euler animation before fixing"
     knob = nuke.thisKnob()
     baked = True
 
-    axes = ["x", "y", "z"]
-
     if knob.hasExpression():
         if nuke.ask("This curve is created by an expression. Would you like to bake it now?"):
             ret = nuke.getFramesAndViews(
@@ -80,18 +140,8 @@ def euler_fix():
                 f"{nuke.root().firstFrame()}-{nuke.root().lastFrame()}",
             )
             frame_range = nuke.FrameRange(ret[0])
-            for axis in axes:
-                nuke.animation(
-                    f"{knob.name()}.{axis}",
-                    "generate",
-                    (
-                        str(frame_range.first()),
-                        str(frame_range.last()),
-                        "1",
-                        "y",
-                        f"{knob.name()}.{axis}",
-                    ),
-                )
+            if not bake_knob(knob, frame_range.first(), frame_range.last()):
+                return
         else:
             return
 
@@ -118,21 +168,8 @@ def euler_fix():
 
             if not baked:
                 if nuke.ask("This curve doesn't seem to be baked. Would you like to do that now?"):
-                    nuke.animation(
-                        f"{knob.name()}.x",
-                        "generate",
-                        (str(first), str(last), "1", "y", f"{knob.name()}.x"),
-                    )
-                    nuke.animation(
-                        f"{knob.name()}.y",
-                        "generate",
-                        (str(first), str(last), "1", "y", f"{knob.name()}.y"),
-                    )
-                    nuke.animation(
-                        f"{knob.name()}.z",
-                        "generate",
-                        (str(first), str(last), "1", "y", f"{knob.name()}.z"),
-                    )
+                    if not bake_knob(knob, first, last):
+                        return
 
             rl = ["XYZ", "XZY", "YXZ", "YZX", "ZXY", "ZYX"]
 
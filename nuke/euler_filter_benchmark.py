@@ -0,0 +1,159 @@
+"""
+Euler Filter Benchmark
+runs the filter core of euler_filter.py without Nuke on synthetic rotation curves
+* smooth ground truth per rotation order, including regions close to gimbal lock
+* injected 180° flips (equivalent euler solution) and 360° wraps, like a matrix decomposition
+* reports correctness (max discontinuity, max orientation error) and speed (frames/s)
+* exits with status 1 if the filtered curves jump more than the ground truth or change the
+  orientation, so it can guard the filter against regressions
+
+usage: python euler_filter_benchmark.py [--frames 10000] [--seed 1] [--repeat 3]
+                                        [--tolerance 0.001]
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+
+from euler_filter import filter_rotation
+
+ROTATION_ORDERS = ["XYZ", "XZY", "YXZ", "YZX", "ZXY", "ZYX"]
+
+
+def axis_matrix(axis, degrees):
+    "rotation matrix around a single axis"
+    c = math.cos(math.radians(degrees))
+    s = math.sin(math.radians(degrees))
+    if axis == "X":
+        return [[1, 0, 0], [0, c, -s], [0, s, c]]
+    if axis == "Y":
+        return [[c, 0, s], [0, 1, 0], [-s, 0, c]]
+    return [[c, -s, 0], [s, c, 0], [0, 0, 1]]
+
+
+def multiply(a, b):
+    "3x3 matrix product"
+    return [[sum(a[r][i] * b[i][c] for i in range(3)) for c in range(3)] for r in range(3)]
+
+
+def euler_to_matrix(rotation, ro):
+    "matrix of x, y, z rotation, first axis of rotation order is applied first"
+    matrix = [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    for axis in ro:
+        matrix = multiply(axis_matrix(axis, rotation["XYZ".index(axis)]), matrix)
+
+    return matrix
+
+
+def orientation_error(a, b):
+    "angle in degrees between two rotation matrices"
+    trace = sum(a[0][i] * b[0][i] + a[1][i] * b[1][i] + a[2][i] * b[2][i] for i in range(3))
+    return math.degrees(math.acos(max(-1.0, min(1.0, (trace - 1) / 2))))
+
+
+def wrap(value):
+    "wrap angle into -180 to 180 like a decomposition would"
+    return (value + 180) % 360 - 180
+
+
+def flipped(rotation, ro):
+    "equivalent euler solution, outer axes +180 and middle axis mirrored"
+    first, middle, last = ["XYZ".index(a) for a in ro]
+    alternative = list(rotation)
+    alternative[first] += 180
+    alternative[middle] = 180 - alternative[middle]
+    alternative[last] += 180
+
+    return alternative
+
+
+def make_curves(frames, ro, seed):
+    """generate ground truth and corrupted rotation curves
+    - returns truth and raw list of [x, y, z] per frame
+    """
+    rnd = random.Random(seed)
+    middle = "XYZ".index(ro[1])
+    phases = [rnd.uniform(0, math.tau) for _ in range(3)]
+    speeds = [rnd.uniform(0.002, 0.02) for _ in range(3)]
+    spins = [rnd.uniform(-4, 4) for _ in range(3)]
+
+    truth = []
+    for f in range(frames):
+        rotation = [spins[a] * f + 120 * math.sin(speeds[a] * f + phases[a]) for a in range(3)]
+        # drift the middle axis towards 90 degrees, every so often into gimbal lock
+        rotation[middle] = 89.5 * math.sin(speeds[middle] * f + phases[middle])
+        truth.append(rotation)
+
+    raw = []
+    flip = False
+    for rotation in truth:
+        if rnd.random() < 0.01:
+            flip = not flip
+        values = flipped(rotation, ro) if flip else rotation
+        raw.append([wrap(v) for v in values])
+
+    return truth, raw
+
+
+def max_discontinuity(curves):
+    "largest change of any axis between two neighbouring frames"
+    return max(abs(curr[a] - prev[a]) for prev, curr in zip(curves, curves[1:]) for a in range(3))
+
+
+def max_orientation_error(truth, curves, ro):
+    "largest orientation difference between filtered and ground truth rotation"
+    return max(
+        orientation_error(euler_to_matrix(t, ro), euler_to_matrix(c, ro))
+        for t, c in zip(truth, curves)
+    )
+
+
+def run(frames, seed, repeat, tolerance=0.001):
+    """benchmark all rotation orders and print a report
+    -   tolerance: degrees the filtered curves may exceed the truth's jumps and orientation
+    - returns True if all rotation orders are filtered correctly
+    """
+    print(
+        f"{'order':<6}{'raw jump':>10}{'filtered':>10}{'truth':>10}"
+        + f"{'orient err':>12}{'frames/s':>14}"
+    )
+    passed = True
+    for ro in ROTATION_ORDERS:
+        truth, raw = make_curves(frames, ro, seed)
+
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            filtered = filter_rotation(raw, ro)
+            best = min(best, time.perf_counter() - start)
+
+        jump = max_discontinuity(filtered)
+        error = max_orientation_error(truth, filtered, ro)
+        ok = jump <= max_discontinuity(truth) + tolerance and error <= tolerance
+        passed &= ok
+        print(
+            f"{ro:<6}"
+            + f"{max_discontinuity(raw):>10.2f}"
+            + f"{jump:>10.2f}"
+            + f"{max_discontinuity(truth):>10.2f}"
+            + f"{error:>12.4f}"
+            + f"{frames / best:>14.0f}"
+            + ("" if ok else "  FAILED")
+        )
+
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--frames", type=int, default=10000, help="frames per curve")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the curves")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs, best one counts")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.001, help="allowed error in degrees before failing"
+    )
+    args = parser.parse_args()
+
+    sys.exit(0 if run(args.frames, args.seed, args.repeat, args.tolerance) else 1)